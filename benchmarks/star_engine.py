@@ -0,0 +1,65 @@
+""" Benchmark of the many-mode star engine
+
+Runs dynamics and spectra for cavities with a growing number of photonic modes and prints the run times,
+and checks the star engine against the propagator engine on a small cavity. Run from the repository root:
+
+    python benchmarks/star_engine.py
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from source.simulation import Simulation  # noqa: E402
+
+
+def create_config(directory, number_of_modes, engine):
+    """ cavity with number_of_modes modes spread around the exciton energy, written to files in directory """
+    rng = np.random.default_rng(number_of_modes)
+    files = {
+        'file_photon_energies': np.linspace(3.0, 4.0, number_of_modes),
+        'file_photon_dampings': np.full(number_of_modes, 0.006582),
+        'file_photon_pumpings': np.zeros(number_of_modes),
+        'file_strengths': 0.15 * rng.random(number_of_modes) / np.sqrt(number_of_modes),
+        'file_initial_photon_counts': np.zeros(number_of_modes),
+    }
+    photonic_modes = {'number_of_modes': number_of_modes}
+    for key, values in files.items():
+        path = os.path.join(directory, f'{key}_{number_of_modes}.txt')
+        np.savetxt(path, values)
+        photonic_modes[key] = path
+
+    return {
+        'photonic_modes': photonic_modes,
+        'excitonic_mode': {'exciton_energy_ev': 3.5, 'damping_ev': 0.05, 'pumping_ev': 0.0, 'initial_excitons': 1},
+        'dynamic_configuration': {'time_step_ps': 0.0001, 'time_end_ps': 0.2, 'engine': engine},
+        'spectra_configuration': {'min_energy_ev': 3.0, 'energy_step_ev': 0.001, 'max_energy_ev': 4.0},
+    }
+
+
+def run(config):
+    simulation = Simulation()
+    simulation.set_config_data(config)
+    start = time.perf_counter()
+    simulation.calculate_dynamics()
+    simulation.calculate_spectra()
+    return simulation, time.perf_counter() - start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        reference, _ = run(create_config(directory, 40, 'propagator'))
+        star, _ = run(create_config(directory, 40, 'star'))
+        error = np.abs(star.spectra - reference.spectra).max() / np.abs(reference.spectra).max()
+        print(f"40 modes, relative deviation from the propagator engine: {error:.1e}")
+
+        print("modes   time (s)")
+        for number_of_modes in [125, 250, 500, 1000]:
+            _, elapsed = run(create_config(directory, number_of_modes, 'star'))
+            print(f"{number_of_modes:5d}   {elapsed:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
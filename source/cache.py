@@ -0,0 +1,75 @@
+import hashlib
+import os
+import numpy as np
+
+
+def make_key(*parts):
+    """ hash of the given arrays and values, used as the address of a cache entry """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(f"{part.dtype.str}{part.shape}".encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """ on-disk store of result arrays addressed by a hash of everything they depend on
+
+    Every entry is one .npz file. Reading an entry marks it as recently used, and the least recently
+    used entries are removed once the directory grows beyond max_size_mb.
+    """
+
+    def __init__(self, directory, max_size_mb=1024):
+        self.directory = directory
+        self.max_size = max_size_mb * 1024 * 1024
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key):
+        """ arrays stored under key, or None """
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def contains(self, key):
+        return os.path.exists(self.path(key))
+
+    def save(self, key, **arrays):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        # write to a temporary file first, so that concurrent readers never see a partial entry
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total_size -= size
@@ -33,6 +33,7 @@ class Ui_MainWindow(object):
         self.setup_excitonic_mode(self.config_layout)
         self.setup_dynamic_configuration(self.config_layout)
         self.setup_spectra_configuration(self.config_layout)
+        self.setup_live_preview(self.config_layout)
 
         self.dynamics_layout = QtWidgets.QHBoxLayout()
         self.btn_calculate_dynamics = QtWidgets.QPushButton("Calculate Dynamics")
@@ -73,6 +74,14 @@ class Ui_MainWindow(object):
         self.graph_widget_dynamics.showGrid(True, True)
         self.graph_widget_dynamics.addLegend()
 
+        # checkable list of the modes, to show or hide their curves
+        self.list_widget_modes = QtWidgets.QListWidget()
+        self.graph_widget_dynamics.parentWidget().layout().addWidget(self.list_widget_modes)
+        self.list_widget_modes.setFlow(QtWidgets.QListView.LeftToRight)
+        self.list_widget_modes.setWrapping(True)
+        self.list_widget_modes.setMaximumHeight(60)
+        self.list_widget_modes.itemChanged.connect(self.MainWindow.mode_toggled)
+
         self.graph_widget_spectra = self.add_graph_tab("Spectra")
         self.graph_widget_spectra.getAxis('left').setStyle(tickTextOffset=10, tickFont=font)
         self.graph_widget_spectra.getAxis('left').setLabel('Intensity', **{'font': font})
@@ -80,11 +89,28 @@ class Ui_MainWindow(object):
         self.graph_widget_spectra.getAxis('bottom').setLabel('Energy', units='eV', **{'font': font})
         self.graph_widget_spectra.showGrid(True, True)
 
+        # time-resolved spectra, shown below the spectrum when they are calculated
+        self.graph_widget_spectrogram = pg.PlotWidget(background='w')
+        self.graph_widget_spectra.parentWidget().layout().addWidget(self.graph_widget_spectrogram)
+        self.graph_widget_spectrogram.getAxis('left').setStyle(tickTextOffset=10, tickFont=font)
+        self.graph_widget_spectrogram.getAxis('left').setLabel('Emission time', units='s', **{'font': font})
+        self.graph_widget_spectrogram.getAxis('bottom').setStyle(tickTextOffset=10, tickFont=font)
+        self.graph_widget_spectrogram.getAxis('bottom').setLabel('Energy', units='eV', **{'font': font})
+        self.spectrogram_image = pg.ImageItem()
+        self.graph_widget_spectrogram.addItem(self.spectrogram_image)
+        self.graph_widget_spectrogram.hide()
+
+        self.progress_layout = QtWidgets.QHBoxLayout()
         self.progress_bar = QtWidgets.QProgressBar(self.graph_area)
         self.progress_bar.setObjectName("progressBar")
         self.progress_bar.setValue(0)
         self.progress_bar.setMaximum(100)
-        self.graph_layout.addWidget(self.progress_bar)
+        self.progress_layout.addWidget(self.progress_bar)
+
+        self.btn_cancel = QtWidgets.QPushButton("Cancel")
+        self.btn_cancel.setEnabled(False)
+        self.progress_layout.addWidget(self.btn_cancel)
+        self.graph_layout.addLayout(self.progress_layout)
 
         self.gridLayout.addWidget(self.splitter_main, 0, 0, 1, 1)
         MainWindow.setCentralWidget(self.centralwidget)
@@ -218,6 +244,14 @@ class Ui_MainWindow(object):
         form_layout.addRow(self.label_initial_excitons, self.lineEdit_initial_excitons)
         self.lineEdit_initial_excitons.textChanged.connect(self.MainWindow.fields_changed)
 
+        self.lineEdit_exciton_interaction = QtWidgets.QLineEdit("")
+        interaction_validator = QtGui.QDoubleValidator(-1000.0, 1000.0, 20)
+        interaction_validator.setNotation(QtGui.QDoubleValidator.StandardNotation)
+        self.lineEdit_exciton_interaction.setValidator(interaction_validator)
+        self.label_exciton_interaction = QtWidgets.QLabel("Exciton-Exciton Interaction, eV:")
+        form_layout.addRow(self.label_exciton_interaction, self.lineEdit_exciton_interaction)
+        self.lineEdit_exciton_interaction.textChanged.connect(self.MainWindow.fields_changed)
+
 
     def setup_dynamic_configuration(self, layout):
         group = QtWidgets.QGroupBox("Dynamic Configuration")
@@ -262,6 +296,32 @@ class Ui_MainWindow(object):
         form_layout.addRow("Maximum Energy, eV:", self.line_edit_max_energy)
         self.line_edit_max_energy.textChanged.connect(self.MainWindow.fields_changed)
 
+    def setup_live_preview(self, layout):
+        group = QtWidgets.QGroupBox("Live Preview")
+        layout.addWidget(group)
+        form_layout = QtWidgets.QFormLayout(group)
+
+        self.checkBox_live_preview = QtWidgets.QCheckBox("Preview the spectrum while editing")
+        form_layout.addRow(self.checkBox_live_preview)
+        self.checkBox_live_preview.toggled.connect(self.MainWindow.schedule_preview)
+
+        # every slider sets the field next to its name, see MainWindow.preview_slider_moved
+        self.slider_exciton_energy = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.label_slider_exciton_energy = QtWidgets.QLabel("Exciton Energy:")
+        self.slider_exciton_damping = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.label_slider_exciton_damping = QtWidgets.QLabel("Exciton Damping:")
+        self.slider_photon_strength = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.label_slider_photon_strength = QtWidgets.QLabel("Coupling Strength:")
+        self.slider_photon_damping = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.label_slider_photon_damping = QtWidgets.QLabel("Photon Damping:")
+        for label, slider in [(self.label_slider_exciton_energy, self.slider_exciton_energy),
+                              (self.label_slider_exciton_damping, self.slider_exciton_damping),
+                              (self.label_slider_photon_strength, self.slider_photon_strength),
+                              (self.label_slider_photon_damping, self.slider_photon_damping)]:
+            slider.setRange(0, 1000)
+            form_layout.addRow(label, slider)
+            slider.valueChanged.connect(self.MainWindow.preview_slider_moved)
+
     def handle_mode_change(self, text):
         num_modes = int(text) if text.isdigit() else 0
         if num_modes == 1:
@@ -287,6 +347,9 @@ class Ui_MainWindow(object):
         self.lineEdit_photon_strength.show()
         self.lineEdit_initial_photons.show()
 
+        self.label_slider_photon_strength.setText("Coupling Strength:")
+        self.label_slider_photon_damping.setText("Photon Damping:")
+
     def hide_single_mode_ui(self):
         self.label_photon_energy.hide()
         self.label_photon_damping.hide()
@@ -300,6 +363,10 @@ class Ui_MainWindow(object):
         self.lineEdit_photon_strength.hide()
         self.lineEdit_initial_photons.hide()
 
+        # with several modes, these sliders scale the strengths and dampings of all modes
+        self.label_slider_photon_strength.setText("Coupling Strength (x all modes):")
+        self.label_slider_photon_damping.setText("Photon Damping (x all modes):")
+
     def show_multiple_mode_ui(self):
         self.label_file_photon_energies.show()
         self.lineEdit_file_photon_energies.show()
@@ -0,0 +1,172 @@
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import time
+import numpy as np
+import yaml
+from scipy import optimize
+from source.config_manager import ConfigManager
+from source.simulation import Simulation
+
+
+# prefix of fit parameters that scale a column of all photon modes instead of setting a config value
+SCALE_PREFIX = 'scale/'
+COLUMN_ARRAYS = {'energy_ev': 'W', 'damping_ev': 'gamma', 'pumping_ev': 'P', 'strength_ev': 'g',
+                 'initial_photons': 'initial_count'}
+
+
+def fast_config(config_data):
+    """ config_data with the fastest engines that give the same spectrum
+
+    The propagator replaces the ode engine for linear equations, the trajectory is streamed, the spectrum
+    is evaluated in closed form, and no time-resolved spectra are calculated.
+    """
+    config_data = copy.deepcopy(config_data)
+    dynamic_configuration = config_data['dynamic_configuration']
+    if dynamic_configuration.get('engine', 'ode') == 'ode' and \
+            config_data['excitonic_mode'].get('interaction_ev', 0) == 0:
+        dynamic_configuration['engine'] = 'propagator'
+    dynamic_configuration['store_trajectory'] = False
+    config_data['spectra_configuration']['engine'] = 'eigen'
+    config_data['spectra_configuration'].pop('gate_ps', None)
+    return config_data
+
+
+def apply_scales(simulation, scales):
+    """ multiply columns of the photon modes of a set up simulation, e.g. {'strength_ev': 1.1} """
+    for column, factor in scales.items():
+        getattr(simulation, COLUMN_ARRAYS[column])[1:] *= factor
+    simulation.G = simulation.gamma - simulation.P
+
+
+def evaluate_point(simulation, config_data, scales, energies):
+    """ the real simulated spectrum at energies for one parameter set, and the time it took """
+    start = time.perf_counter()
+    simulation.set_config_data(config_data)
+    apply_scales(simulation, scales)
+    simulation.calculate_dynamics()
+    spectrum = np.real(simulation.spectrum_at(energies))
+    return spectrum, time.perf_counter() - start
+
+
+def run_point(config_data, scales, energies):
+    """ evaluate_point in a worker process """
+    return evaluate_point(Simulation(), config_data, scales, energies)
+
+
+class SpectrumFit:
+    """ least-squares fit of the simulated spectrum to a measured one over chosen parameters
+
+    parameters are dicts with a 'path' in the config (or 'scale/<column>' for a factor on a column of all
+    photon modes), optional 'lower' and 'upper' bounds and an optional 'initial' value (by default the value
+    in base_config, or 1 for a scale). The simulated spectrum is multiplied by the amplitude that fits the
+    measurement best, as measured intensities have arbitrary units. With workers > 1, the points of every
+    finite-difference Jacobian are evaluated in parallel.
+    """
+
+    def __init__(self, base_config, parameters, data_path, workers=1, fast=True, max_evaluations=None,
+                 diff_step=1e-6):
+        self.base_config = fast_config(base_config) if fast else base_config
+        self.parameters = parameters
+        data = np.loadtxt(data_path, ndmin=2)
+        if data.shape[1] < 2:
+            raise ValueError(f"{data_path} needs two columns: energy (eV) and intensity")
+        self.energies, self.measured = data[:, 0], data[:, 1]
+        self.workers = workers
+        self.max_evaluations = max_evaluations
+        self.diff_step = diff_step
+
+        config_manager = ConfigManager()
+        config_manager.config_data = self.base_config
+        self.initial = np.array([parameter.get('initial', 1.0 if parameter['path'].startswith(SCALE_PREFIX)
+                                               else config_manager.get_value(parameter['path']))
+                                 for parameter in parameters], dtype=np.float64)
+        self.bounds = ([parameter.get('lower', -np.inf) for parameter in parameters],
+                       [parameter.get('upper', np.inf) for parameter in parameters])
+
+        self.simulation = Simulation()
+        self.spectra = {} # simulated spectra by parameter values, so that no point is evaluated twice
+        self.evaluations = 0
+        self.evaluation_time = 0
+        self.executor = None
+        self.progress_callback = None
+
+    @classmethod
+    def from_file(cls, path):
+        """ fit described by a YAML file with base_config, data, parameters and optionally workers, fast,
+        max_evaluations and diff_step """
+        with open(path, 'r') as file:
+            description = yaml.safe_load(file)
+        config_manager = ConfigManager(description['base_config'])
+        config_manager.load_config()
+        return cls(config_manager.config_data, description['parameters'], description['data'],
+                   description.get('workers', 1), description.get('fast', True),
+                   description.get('max_evaluations'), description.get('diff_step', 1e-6))
+
+    def point(self, x):
+        """ config and column scales of the parameter values x """
+        config_manager = ConfigManager()
+        config_manager.config_data = copy.deepcopy(self.base_config)
+        scales = {}
+        for parameter, value in zip(self.parameters, x):
+            if parameter['path'].startswith(SCALE_PREFIX):
+                scales[parameter['path'][len(SCALE_PREFIX):]] = float(value)
+            else:
+                config_manager.set_value(parameter['path'], float(value))
+        return config_manager.config_data, scales
+
+    def simulate(self, points):
+        """ simulated spectra of several parameter sets, in parallel if there is a pool of workers """
+        missing = [x for x in dict.fromkeys(tuple(x) for x in points) if x not in self.spectra]
+        if self.executor is not None and len(missing) > 1:
+            results = self.executor.map(run_point, *zip(*[self.point(x) + (self.energies,) for x in missing]))
+        else:
+            results = (evaluate_point(self.simulation, *self.point(x), self.energies) for x in missing)
+        for x, (spectrum, elapsed) in zip(missing, results):
+            self.spectra[x] = spectrum
+            self.evaluations += 1
+            self.evaluation_time += elapsed
+        if self.progress_callback is not None and missing:
+            self.progress_callback(self.evaluations)
+        return [self.spectra[tuple(x)] for x in points]
+
+    def amplitude(self, spectrum):
+        """ factor of the simulated spectrum that fits the measurement best """
+        norm = np.dot(spectrum, spectrum)
+        return np.dot(spectrum, self.measured) / norm if norm > 0 else 0.0
+
+    def residuals(self, x):
+        spectrum, = self.simulate([x])
+        return self.amplitude(spectrum) * spectrum - self.measured
+
+    def jacobian(self, x):
+        """ forward differences of the residuals, with all shifted points evaluated together """
+        steps = self.diff_step * np.maximum(np.abs(x), 1e-3)
+        # step away from a bound that would otherwise be crossed
+        steps = np.where(x + steps > self.bounds[1], -steps, steps)
+        shifted = [x + step * np.eye(len(x))[i] for i, step in enumerate(steps)]
+        spectra = self.simulate([x] + shifted)
+        base = self.amplitude(spectra[0]) * spectra[0]
+        return np.column_stack([(self.amplitude(spectrum) * spectrum - base) / step
+                                for spectrum, step in zip(spectra[1:], steps)])
+
+    def run(self, progress_callback=None):
+        """ run the fit; progress_callback gets the number of evaluated points. Returns the report """
+        self.progress_callback = progress_callback
+        start = time.perf_counter()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            result = optimize.least_squares(self.residuals, self.initial, jac=self.jacobian, bounds=self.bounds,
+                                            x_scale='jac', max_nfev=self.max_evaluations)
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.executor = None
+
+        spectrum, = self.simulate([result.x])
+        amplitude = self.amplitude(spectrum)
+        return {'parameters': {parameter['path']: float(value) for parameter, value in zip(self.parameters, result.x)},
+                'amplitude': float(amplitude), 'cost': float(result.cost), 'success': bool(result.success),
+                'message': result.message, 'evaluations': self.evaluations,
+                'evaluation_time': self.evaluation_time, 'time': time.perf_counter() - start,
+                'energy': self.energies, 'measured': self.measured, 'fitted': amplitude * spectrum,
+                'residuals': amplitude * spectrum - self.measured}
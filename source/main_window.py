@@ -0,0 +1,276 @@
+import sys
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QFileDialog, QMessageBox, QListWidgetItem)
+from source.design import Ui_MainWindow
+from source.core import Core
+from source.config_manager import ConfigManager
+from source.utilities import safe_int, safe_float
+
+
+# fields set by the live preview sliders, with their ranges (None: the energy range of the spectra)
+PREVIEW_FIELDS = {'slider_exciton_energy': ('lineEdit_exciton_energy', 'excitonic_mode/exciton_energy_ev', None),
+                  'slider_exciton_damping': ('lineEdit_exciton_damping', 'excitonic_mode/damping_ev', (0.0, 0.2)),
+                  'slider_photon_strength': ('lineEdit_photon_strength', 'photonic_modes/strength_ev', (0.0, 0.5)),
+                  'slider_photon_damping': ('lineEdit_photon_damping', 'photonic_modes/damping_ev', (0.0, 0.2))}
+# with several modes, the photon sliders set factors on all modes instead of the single-mode fields
+PREVIEW_SCALES = {'slider_photon_strength': 'photonic_modes/strength_scale',
+                  'slider_photon_damping': 'photonic_modes/damping_scale'}
+PREVIEW_SCALE_RANGE = (0.0, 2.0)
+PREVIEW_DELAY = 30 # ms without changes before the preview is redrawn
+
+
+class MainWindow(QMainWindow):
+    def __init__(self, core, config_manager):
+        super().__init__()
+        self.ui = Ui_MainWindow()
+        self.ui.setup_ui(self)
+        self.core = core
+        self.config_manager = config_manager
+
+        #Connect signals and slots
+        self.ui.actionNewConfig.triggered.connect(self.new_config)
+        self.ui.actionLoadConfig.triggered.connect(self.load_config)
+        self.ui.actionSaveConfig.triggered.connect(self.save_config)
+        self.ui.actionExit.triggered.connect(self.exit_app)
+        self.ui.btn_calculate_dynamics.clicked.connect(self.run_calculate_dynamics)
+        self.ui.btn_calculate_spectra.clicked.connect(self.run_calculate_spectra)
+        self.ui.btn_save_dynamics.clicked.connect(self.core.save_dynamics_result)
+        self.ui.btn_save_spectra.clicked.connect(self.core.save_spectra)
+        self.ui.btn_cancel.clicked.connect(self.core.cancel)
+
+        # the preview is redrawn once the values stop changing, not on every step of a slider
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DELAY)
+        self.preview_timer.timeout.connect(self.update_preview)
+
+        self.update_ui_inprocess = False
+        self.config_manager.load_config()
+        self.update_ui()
+
+    def new_config(self):
+        self.config_manager.config_data = {}
+        self.update_ui()
+
+    def load_config(self):
+        fname, _ = QFileDialog.getOpenFileName(self, 'Open file', '', 'YAML Files (*.yaml)')
+        if fname:
+            self.config_manager.config_path = fname
+            self.config_manager.load_config()
+            self.update_ui()
+
+    def save_config(self):
+        fname, _ = QFileDialog.getSaveFileName(self, 'Save file', '', 'YAML Files (*.yaml)')
+        if fname:
+            self.config_manager.config_path = fname
+            self.config_manager.save_config()
+
+    def select_file(self, line_edit):
+        fname, _ = QFileDialog.getOpenFileName(None, 'Open file', '', 'Text Files (*.txt)')
+        if fname:
+            line_edit.setText(fname)
+
+    def run_calculate_dynamics(self):
+        self.core.set_config_data(self.config_manager.config_data)
+        # the previous dynamics are no longer current, whether this run finishes or not
+        self.ui.btn_calculate_spectra.setEnabled(False)
+        self.ui.btn_save_dynamics.setEnabled(False)
+        self.ui.btn_save_spectra.setEnabled(False)
+        self.set_calculation_running(True)
+        self.core.calculate_dynamics(self.ui.progress_bar, self.dynamics_done, self.ui.graph_widget_dynamics)
+        self.update_mode_list()
+        self.ui.tab_widget.setCurrentIndex(0)
+
+    def dynamics_done(self, status, message):
+        self.set_calculation_running(False)
+        if status == 'finished':
+            self.core.plot_dynamics(self.ui.graph_widget_dynamics)
+            self.ui.btn_calculate_spectra.setEnabled(True)
+            self.ui.btn_save_dynamics.setEnabled(True)
+            self.ui.tab_widget.setCurrentIndex(0)
+        else:
+            self.calculation_stopped(status, message)
+
+    def update_mode_list(self):
+        """ one checkable entry per mode; modes that were unchecked stay hidden """
+        modes = self.ui.list_widget_modes
+        hidden = {modes.item(i).text() for i in range(modes.count()) if modes.item(i).checkState() != Qt.Checked}
+        modes.blockSignals(True)
+        modes.clear()
+        for i, name in enumerate(self.core.mode_names()):
+            item = QListWidgetItem(name, modes)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Unchecked if name in hidden else Qt.Checked)
+            if name in hidden:
+                self.core.show_mode(i, False)
+        modes.blockSignals(False)
+
+    def mode_toggled(self, item):
+        self.core.show_mode(self.ui.list_widget_modes.row(item), item.checkState() == Qt.Checked)
+
+    def run_calculate_spectra(self):
+        self.core.set_config_data(self.config_manager.config_data)
+        self.set_calculation_running(True)
+        self.core.calculate_spectra(self.ui.progress_bar, self.spectra_done)
+
+    def spectra_done(self, status, message):
+        self.set_calculation_running(False)
+        if status == 'finished':
+            self.core.plot_spectra(self.ui.graph_widget_spectra)
+            self.core.plot_time_resolved_spectra(self.ui.graph_widget_spectrogram, self.ui.spectrogram_image)
+            self.ui.btn_save_spectra.setEnabled(True)
+            self.ui.tab_widget.setCurrentIndex(1)
+        else:
+            self.calculation_stopped(status, message)
+
+    def set_calculation_running(self, running):
+        # the configuration cannot be edited while the simulation uses it on the worker thread
+        self.ui.config_area.setEnabled(not running)
+        self.ui.menubar.setEnabled(not running)
+        self.ui.btn_cancel.setEnabled(running)
+
+    def calculation_stopped(self, status, message):
+        self.ui.progress_bar.setValue(0)
+        if status == 'failed':
+            QMessageBox.critical(self, "Calculation failed", message)
+
+
+    def update_ui(self):
+        self.update_ui_inprocess = True
+        self.ui.lineEdit_number_of_modes.setText(str(self.config_manager.get_value('photonic_modes/number_of_modes', '')))
+        self.ui.lineEdit_photon_energy.setText(str(self.config_manager.get_value('photonic_modes/photon_energy_ev', '')))
+        self.ui.lineEdit_photon_damping.setText(str(self.config_manager.get_value('photonic_modes/damping_ev', '')))
+        self.ui.lineEdit_photon_pumping.setText(str(self.config_manager.get_value('photonic_modes/pumping_ev', '')))
+        self.ui.lineEdit_photon_strength.setText(str(self.config_manager.get_value('photonic_modes/strength_ev', '')))
+        self.ui.lineEdit_initial_photons.setText(str(self.config_manager.get_value('photonic_modes/initial_photons', '')))
+
+        self.ui.lineEdit_file_photon_energies.setText(str(self.config_manager.get_value('photonic_modes/file_photon_energies', '')))
+        self.ui.lineEdit_file_photon_dampings.setText(str(self.config_manager.get_value('photonic_modes/file_photon_dampings', '')))
+        self.ui.lineEdit_file_photon_pumpings.setText(str(self.config_manager.get_value('photonic_modes/file_photon_pumpings', '')))
+        self.ui.lineEdit_file_initial_photon_counts.setText(str(self.config_manager.get_value('photonic_modes/file_initial_photon_counts', '')))
+        self.ui.lineEdit_file_strengths.setText(str(self.config_manager.get_value('photonic_modes/file_strengths', '')))
+
+        self.ui.lineEdit_exciton_energy.setText(str(self.config_manager.get_value('excitonic_mode/exciton_energy_ev', '')))
+        self.ui.lineEdit_exciton_damping.setText(str(self.config_manager.get_value('excitonic_mode/damping_ev', '')))
+        self.ui.lineEdit_exciton_pumping.setText(str(self.config_manager.get_value('excitonic_mode/pumping_ev', '')))
+        self.ui.lineEdit_initial_excitons.setText(str(self.config_manager.get_value('excitonic_mode/initial_excitons', '')))
+        self.ui.lineEdit_exciton_interaction.setText(str(self.config_manager.get_value('excitonic_mode/interaction_ev', 0)))
+
+        self.ui.lineEdit_time_step.setText(str(self.config_manager.get_value('dynamic_configuration/time_step_ps', '')))
+        self.ui.lineEdit_time_end.setText(str(self.config_manager.get_value('dynamic_configuration/time_end_ps', '')))
+
+        self.ui.lineEdit_min_energy.setText(str(self.config_manager.get_value('spectra_configuration/min_energy_ev', '')))
+        self.ui.line_edit_energy_step.setText(str(self.config_manager.get_value('spectra_configuration/energy_step_ev', '')))
+        self.ui.line_edit_max_energy.setText(str(self.config_manager.get_value('spectra_configuration/max_energy_ev', '')))
+
+        self.update_ui_inprocess = False
+        self.sync_preview_sliders()
+
+    def fields_changed(self):
+        if self.update_ui_inprocess:
+            return
+        self.config_manager.set_value('photonic_modes/number_of_modes', safe_int(self.ui.lineEdit_number_of_modes.text()))
+        self.config_manager.set_value('photonic_modes/photon_energy_ev', safe_float(self.ui.lineEdit_photon_energy.text()))
+        self.config_manager.set_value('photonic_modes/damping_ev', safe_float(self.ui.lineEdit_photon_damping.text()))
+        self.config_manager.set_value('photonic_modes/pumping_ev', safe_float(self.ui.lineEdit_photon_pumping.text()))
+        self.config_manager.set_value('photonic_modes/strength_ev', safe_float(self.ui.lineEdit_photon_strength.text()))
+        self.config_manager.set_value('photonic_modes/initial_photons', safe_int(self.ui.lineEdit_initial_photons.text()))
+
+        self.config_manager.set_value('photonic_modes/file_photon_energies', self.ui.lineEdit_file_photon_energies.text())
+        self.config_manager.set_value('photonic_modes/file_photon_dampings', self.ui.lineEdit_file_photon_dampings.text())
+        self.config_manager.set_value('photonic_modes/file_photon_pumpings', self.ui.lineEdit_file_photon_pumpings.text())
+        self.config_manager.set_value('photonic_modes/file_initial_photon_counts', self.ui.lineEdit_file_initial_photon_counts.text())
+        self.config_manager.set_value('photonic_modes/file_strengths', self.ui.lineEdit_file_strengths.text())
+
+        self.config_manager.set_value('excitonic_mode/exciton_energy_ev', safe_float(self.ui.lineEdit_exciton_energy.text()))
+        self.config_manager.set_value('excitonic_mode/damping_ev', safe_float(self.ui.lineEdit_exciton_damping.text()))
+        self.config_manager.set_value('excitonic_mode/pumping_ev', safe_float(self.ui.lineEdit_exciton_pumping.text()))
+        self.config_manager.set_value('excitonic_mode/initial_excitons', safe_int(self.ui.lineEdit_initial_excitons.text()))
+        self.config_manager.set_value('excitonic_mode/interaction_ev', safe_float(self.ui.lineEdit_exciton_interaction.text()))
+
+        self.config_manager.set_value('dynamic_configuration/time_step_ps', safe_float(self.ui.lineEdit_time_step.text()))
+        self.config_manager.set_value('dynamic_configuration/time_end_ps',safe_float(self.ui.lineEdit_time_end.text()))
+
+        self.config_manager.set_value('spectra_configuration/min_energy_ev', safe_float(self.ui.lineEdit_min_energy.text()))
+        self.config_manager.set_value('spectra_configuration/energy_step_ev', safe_float(self.ui.line_edit_energy_step.text()))
+        self.config_manager.set_value('spectra_configuration/max_energy_ev', safe_float(self.ui.line_edit_max_energy.text()))
+
+        # spectra can be recalculated from the existing dynamics as long as only the spectra configuration changed
+        dynamics_up_to_date = self.core.dynamics_up_to_date(self.config_manager.config_data)
+        self.ui.btn_calculate_spectra.setEnabled(dynamics_up_to_date)
+        self.ui.btn_save_dynamics.setEnabled(dynamics_up_to_date)
+        self.ui.btn_save_spectra.setEnabled(False)
+
+        self.sync_preview_sliders()
+        self.schedule_preview()
+
+    def preview_range(self, value_range):
+        if value_range is None:
+            return (safe_float(self.config_manager.get_value('spectra_configuration/min_energy_ev', 0)),
+                    safe_float(self.config_manager.get_value('spectra_configuration/max_energy_ev', 0)))
+        return value_range
+
+    def has_multiple_modes(self):
+        return safe_int(self.config_manager.get_value('photonic_modes/number_of_modes', 0)) > 1 or \
+            bool(self.config_manager.get_value('photonic_modes/file_modes'))
+
+    def preview_slider_target(self, name):
+        """ line edit (None for a scale), config path and value range that the slider name controls """
+        line_edit, path, value_range = PREVIEW_FIELDS[name]
+        if name in PREVIEW_SCALES and self.has_multiple_modes():
+            return None, PREVIEW_SCALES[name], PREVIEW_SCALE_RANGE
+        return line_edit, path, self.preview_range(value_range)
+
+    def preview_slider_moved(self, position):
+        """ set the field (or scale) of the moved slider, which updates the config and schedules the preview """
+        name = next(name for name in PREVIEW_FIELDS if getattr(self.ui, name) is self.sender())
+        line_edit, path, (minimum, maximum) = self.preview_slider_target(name)
+        value = float(f"{minimum + (maximum - minimum) * position / 1000:.6g}")
+        if line_edit is None:
+            self.config_manager.set_value(path, value)
+            self.fields_changed()
+        else:
+            getattr(self.ui, line_edit).setText(f"{value:.6g}")
+
+    def sync_preview_sliders(self):
+        """ move the sliders to the values in the config, without triggering them """
+        for name in PREVIEW_FIELDS:
+            line_edit, path, (minimum, maximum) = self.preview_slider_target(name)
+            value = safe_float(self.config_manager.get_value(path, 1.0 if line_edit is None else minimum))
+            slider = getattr(self.ui, name)
+            slider.blockSignals(True)
+            if maximum > minimum:
+                slider.setValue(int(round((value - minimum) / (maximum - minimum) * 1000)))
+            slider.blockSignals(False)
+
+    def schedule_preview(self):
+        if self.ui.checkBox_live_preview.isChecked():
+            self.preview_timer.start()
+
+    def update_preview(self):
+        self.core.plot_preview(self.config_manager.config_data, self.ui.graph_widget_spectra)
+        self.ui.graph_widget_spectrogram.hide()
+        self.ui.tab_widget.setCurrentIndex(1)
+
+    def closeEvent(self, event):
+        self.core.cancel()
+        self.core.wait()
+        event.accept()
+
+    def exit_app(self):
+        QApplication.quit()
+
+
+def load_stylesheet(app):
+    with open("source/style.css", "r") as file:
+        app.setStyleSheet(file.read())
+
+
+def main():
+    app = QApplication(sys.argv)
+    core = Core()
+    config_manager = ConfigManager()
+    main_window = MainWindow(core, config_manager)
+    load_stylesheet(app)
+    main_window.show()
+    sys.exit(app.exec_())
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+# columns of a mode table, with the default of the optional ones
+MODE_COLUMNS = ['energy_ev', 'damping_ev', 'pumping_ev', 'strength_ev', 'initial_photons']
+OPTIONAL_COLUMNS = {'pumping_ev': 0.0, 'initial_photons': 0.0}
+
+
+def load_mode_table(path):
+    """ the photon modes of a table as a dict of columns named as in MODE_COLUMNS
+
+    The table is a CSV file with a header line, a .npy file with a structured array (memory-mapped),
+    or an .npz archive with one array per column.
+    """
+    if path.endswith('.npy'):
+        table = np.load(path, mmap_mode='r')
+        if table.dtype.names is None:
+            raise ValueError(f"{path} does not contain a structured array with named columns")
+        columns = {name: table[name] for name in table.dtype.names}
+    elif path.endswith('.npz'):
+        with np.load(path) as table:
+            columns = {name: table[name] for name in table.files}
+    else:
+        with open(path, 'r') as file:
+            names = [name.strip() for name in file.readline().split(',')]
+            values = np.loadtxt(file, delimiter=',', ndmin=2)
+        if values.size and values.shape[1] != len(names):
+            raise ValueError(f"{path} has {values.shape[1]} columns but {len(names)} names in its header")
+        columns = {name: values[:, i] for i, name in enumerate(names)}
+
+    missing = [name for name in MODE_COLUMNS if name not in columns and name not in OPTIONAL_COLUMNS]
+    if missing:
+        raise ValueError(f"{path} lacks the columns {', '.join(missing)}")
+    count = len(columns['energy_ev'])
+    for name, default in OPTIONAL_COLUMNS.items():
+        if name not in columns:
+            columns[name] = np.full(count, default)
+    modes = {name: np.asarray(columns[name], dtype=np.float64) for name in MODE_COLUMNS}
+    check_lengths(modes, count, path)
+    return modes
+
+
+def check_lengths(modes, count, source):
+    """ raise a ValueError naming the first column of modes that does not have count entries """
+    for name, values in modes.items():
+        if np.ndim(values) != 1 or len(values) != count:
+            raise ValueError(f"{name} from {source} has {np.size(values)} entries, expected {count}")
+
+
+def select_modes(modes, min_energy, max_energy):
+    """ the modes with energies between min_energy and max_energy (inclusive) """
+    selected = (modes['energy_ev'] >= min_energy) & (modes['energy_ev'] <= max_energy)
+    if not np.any(selected):
+        raise ValueError(f"No photon mode has an energy between {min_energy} and {max_energy} eV")
+    return {name: values[selected] for name, values in modes.items()}
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+MAX_POINTS = 4000 # most points kept per curve, about twice the width of a screen
+
+
+def decimate(x, y, max_points):
+    """ at most max_points points of the columns of y (shape (len(x), curves)) that keep their peaks
+
+    x is split into buckets of consecutive samples, and of each bucket the minimum and maximum of every
+    column are kept, in their order, so narrow spikes survive any decimation. The first and last samples
+    are always kept. Returns the x values (one column per curve, as the kept samples differ) and the y values.
+    x may also have one column per curve, so that decimated curves can be decimated further.
+    """
+    count = len(x)
+    if x.ndim == 1:
+        x = np.broadcast_to(x[:, None], y.shape)
+    if count <= max_points:
+        return x, y
+    buckets = max(1, (max_points - 2) // 2)
+    size = count // buckets
+    # the samples after the last full bucket join it, without copying y
+    blocks = y[:buckets * size].reshape((buckets, size) + y.shape[1:])
+    offsets = np.arange(buckets)[:, None] * size
+    low, high = offsets + blocks.argmin(axis=1), offsets + blocks.argmax(axis=1)
+    if buckets * size < count:
+        tail = y[buckets * size - size:]
+        tail_low, tail_high = tail.argmin(axis=0), tail.argmax(axis=0)
+        low[-1], high[-1] = offsets[-1] + tail_low, offsets[-1] + tail_high
+    ends = np.zeros((1,) + low.shape[1:], dtype=low.dtype)
+    indices = np.concatenate([ends, np.minimum(low, high), np.maximum(low, high), ends + count - 1])
+    indices = np.sort(indices, axis=0)
+    return np.take_along_axis(x, indices, axis=0), np.take_along_axis(y, indices, axis=0)
+
+
+class DecimatedCurves:
+    """ curves of a plot widget over one shared x axis, drawn decimated to the visible x range
+
+    The full data stays here; every change of the view redraws the visible part of the shown curves with
+    two points per pixel of the view (at most max_points), so zooming in reveals the samples that were
+    merged before. The decimated full view is kept, and appended data (e.g. streamed from a running
+    calculation) is decimated on its own and merged into it, so that neither costs more than the new
+    samples. Curves can be hidden and shown again without new data.
+    """
+
+    def __init__(self, plot_widget, max_points=MAX_POINTS):
+        self.plot_widget = plot_widget
+        self.max_points = max_points
+        self.items = []
+        self.x = np.zeros(0)
+        self.y = np.zeros((0, 0))
+        self.chunks = [] # appended (x, y) blocks not yet joined to x and y
+        self.overview = None # decimated x and y of all data and all curves
+        self.redrawing = False
+        plot_widget.getViewBox().sigXRangeChanged.connect(self.redraw)
+
+    def set_curves(self, names, pens):
+        """ remove all data and create one empty curve per name """
+        self.plot_widget.clear()
+        self.items = [self.plot_widget.plot(pen=pen, name=name) for name, pen in zip(names, pens)]
+        self.x = np.zeros(0)
+        self.y = np.zeros((0, len(names)))
+        self.chunks = []
+        self.overview = None
+
+    def set_data(self, x, y):
+        self.x, self.y = np.asarray(x), np.asarray(y)
+        self.chunks = []
+        self.overview = decimate(self.x, self.y, self.max_points)
+        self.redraw()
+
+    def append(self, x, y):
+        """ add samples after the current ones, e.g. populations streamed from a running calculation """
+        x, y = np.asarray(x), np.asarray(y)
+        self.chunks.append((x, y))
+        new_x, new_y = decimate(x, y, self.max_points)
+        if self.overview is not None:
+            new_x = np.concatenate([self.overview[0], new_x])
+            new_y = np.concatenate([self.overview[1], new_y])
+        self.overview = decimate(new_x, new_y, self.max_points)
+        self.redraw()
+
+    def set_visible(self, index, visible):
+        self.items[index].setVisible(visible)
+        self.redraw()
+
+    def points(self):
+        """ points per curve for the current size of the view: a minimum and a maximum per pixel """
+        width = int(self.plot_widget.getViewBox().width())
+        return min(self.max_points, 2 * width + 2) if width > 0 else self.max_points
+
+    def data(self):
+        if self.chunks:
+            self.x = np.concatenate([self.x] + [x for x, _ in self.chunks])
+            self.y = np.concatenate([self.y] + [y for _, y in self.chunks])
+            self.chunks = []
+        return self.x, self.y
+
+    def redraw(self):
+        if self.redrawing or not self.items:
+            return
+        # setting data may rescale the view, which would call redraw again
+        self.redrawing = True
+        try:
+            shown = [i for i, item in enumerate(self.items) if item.isVisible()]
+            view_box = self.plot_widget.getViewBox()
+            if view_box.autoRangeEnabled()[0]:
+                xs, ys = self.overview if self.overview is not None else decimate(*self.data(), self.max_points)
+                xs, ys = decimate(xs[:, shown], ys[:, shown], self.points())
+            else:
+                x, y = self.data()
+                left, right = view_box.viewRange()[0]
+                # one more sample on each side, so the curves reach the edges of the view
+                start = max(0, np.searchsorted(x, left) - 1)
+                stop = min(len(x), np.searchsorted(x, right, side='right') + 1)
+                xs, ys = decimate(x[start:stop], y[start:stop, shown], self.points())
+            for column, i in enumerate(shown):
+                self.items[i].setData(xs[:, column], ys[:, column])
+        finally:
+            self.redrawing = False
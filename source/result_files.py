@@ -0,0 +1,122 @@
+import os
+import struct
+import zipfile
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+HDF5_EXTENSIONS = ('.h5', '.hdf5')
+CHUNK_BYTES = 64 * 1024 * 1024 # largest block of an array written at once
+
+
+def chunk_rows(array):
+    """ number of rows of array that make up about CHUNK_BYTES """
+    row_bytes = max(1, int(np.prod(array.shape[1:])) * np.dtype(array.dtype).itemsize)
+    return max(1, CHUNK_BYTES // row_bytes)
+
+
+def array_chunks(array):
+    """ contiguous blocks of rows of array; lazy arrays such as PackedTrajectory are only read block by block """
+    if np.ndim(array) == 0:
+        yield np.ascontiguousarray(array)
+        return
+    rows = chunk_rows(array)
+    for start in range(0, len(array), rows):
+        yield np.ascontiguousarray(array[start:start + rows])
+
+
+def save_results(path, arrays):
+    """ write arrays (name -> array, None entries are skipped) to an .npz archive or, with h5py, an HDF5 file
+
+    Arrays are written block by block in C order. The .npz archive is not compressed, so that load_results
+    can map its arrays into memory.
+    """
+    arrays = {name: value if hasattr(value, 'shape') else np.asarray(value)
+              for name, value in arrays.items() if value is not None}
+    if path.lower().endswith(HDF5_EXTENSIONS):
+        save_hdf5(path, arrays)
+        return
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, array in arrays.items():
+            with archive.open(name + '.npy', 'w', force_zip64=True) as file:
+                header = {'descr': np.lib.format.dtype_to_descr(np.dtype(array.dtype)), 'fortran_order': False,
+                          'shape': tuple(array.shape)}
+                np.lib.format.write_array_header_2_0(file, header)
+                for chunk in array_chunks(array):
+                    file.write(chunk.tobytes())
+
+
+def save_hdf5(path, arrays):
+    if h5py is None:
+        raise ImportError("Saving HDF5 files needs h5py (pip install h5py)")
+    with h5py.File(path, 'w') as file:
+        for name, array in arrays.items():
+            if np.dtype(array.dtype).kind == 'U':
+                # HDF5 has no fixed-width unicode type; text such as the config goes into an attribute
+                file.attrs[name] = str(np.asarray(array))
+            elif np.ndim(array) == 0 or 0 in array.shape:
+                file.create_dataset(name, data=np.asarray(array))
+            else:
+                rows = min(len(array), chunk_rows(array))
+                dataset = file.create_dataset(name, shape=array.shape, dtype=array.dtype,
+                                              chunks=(max(1, min(rows, 1024)),) + tuple(array.shape[1:]))
+                start = 0
+                for chunk in array_chunks(array):
+                    dataset[start:start + len(chunk)] = chunk
+                    start += len(chunk)
+
+
+def load_results(path):
+    """ arrays written by save_results (or np.savez), without reading them into memory
+
+    The arrays of an uncompressed .npz archive are memory-mapped, those of an HDF5 file are h5py datasets;
+    in both cases slicing reads only the requested part.
+    """
+    if path.lower().endswith(HDF5_EXTENSIONS):
+        if h5py is None:
+            raise ImportError("Loading HDF5 files needs h5py (pip install h5py)")
+        file = h5py.File(path, 'r')
+        arrays = {name: file[name] for name in file}
+        arrays.update({name: value for name, value in file.attrs.items()})
+        return arrays
+
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for info in archive.infolist():
+            name = os.path.splitext(info.filename)[0]
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = read_member(archive, info)
+                continue
+
+            # skip the local header of the zip entry to reach the .npy data
+            file.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<HH', file.read(30)[26:30])
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+
+            if dtype.hasobject or len(shape) == 0 or 0 in shape:
+                arrays[name] = read_member(archive, info)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=file.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return arrays
+
+
+def read_member(archive, info):
+    """ the array of one entry of an .npz archive, read into memory """
+    with archive.open(info) as member:
+        return np.lib.format.read_array(member, allow_pickle=False)
+
+
+def save_text(path, header, columns):
+    """ columns of numbers as a tab-separated text file, written in one call """
+    np.savetxt(path, np.column_stack(columns), fmt='%.17g', delimiter='\t', header=header, comments='')
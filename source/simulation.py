@@ -0,0 +1,1255 @@
+from scipy import integrate, sparse
+import scipy.linalg as scl
+from scipy.linalg import blas
+import numpy as np
+import time
+import yaml
+from source.cache import ResultCache, make_key
+from source.config_manager import ConfigManager
+from source.modes import check_lengths, load_mode_table, select_modes
+
+try:
+    import numba
+except ImportError:
+    # optional, only needed for dynamic_configuration/jit
+    numba = None
+
+
+# part of every cache key; increase it whenever a change alters the numerical results
+ENGINE_VERSION = 4
+
+# reduced Planck constant in eV ps: times are integrated in units of hbar / eV, i.e. t / HBAR_EV_PS for t in ps
+HBAR_EV_PS = 6.582119569 * 10 ** (-4)
+HBAR_EV_S = HBAR_EV_PS * 10 ** (-12) # the same for times in s
+
+# solve_ivp methods that make no use of a Jacobian
+EXPLICIT_SOLVERS = ['RK23', 'RK45', 'DOP853']
+
+
+def packed_dynamics(u, L, ig, P, k, N):
+    """ create_dynamics_matrix written as loops over the packed upper triangle u, to be compiled by numba """
+    # w[j] = sum over m of ig[m] * n[m][j], read from the triangle
+    w = np.zeros(N, dtype=np.complex128)
+    p = 0
+    for i in range(N):
+        w[i] += ig[i] * u[p]
+        p += 1
+        for j in range(i + 1, N):
+            w[j] += ig[i] * u[p]
+            w[i] += ig[j] * np.conj(u[p])
+            p += 1
+
+    V = np.empty(len(u), dtype=np.complex128)
+    p = 0
+    for i in range(N):
+        for j in range(i, N):
+            V[p] = L[p] * u[p] + ig[i] * u[j] - np.conj(u[i]) * ig[j]
+            if i == 0:
+                V[p] += w[j]
+                if j > 0:
+                    V[p] += 2j * k * u[0] * u[j]
+            p += 1
+    for m in range(N):
+        V[0] -= u[m] * ig[m]
+
+    # the diagonal stays real
+    p = 0
+    for i in range(N):
+        V[p] = V[p].real + P[i]
+        p += N - i
+    return V
+
+
+if numba is not None:
+    packed_dynamics = numba.njit(cache=True)(packed_dynamics)
+
+
+class CalculationCancelled(Exception):
+    """ raised inside a running calculation after Simulation.cancel() was called """
+
+
+class PackedTrajectory:
+    """ the flattened full correlation matrices of a packed trajectory, unpacked only for the rows that are read
+
+    Behaves like the array of shape (time, N * N) for indexing and np.asarray, without holding it in memory.
+    """
+
+    def __init__(self, simulation, packed):
+        self.unpack_state = simulation.unpack_state
+        self.packed = packed
+        self.shape = (len(packed), simulation.N * simulation.N)
+        self.dtype = np.dtype(np.complex128)
+        self.ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        rows, columns = (index[0], index[1:]) if isinstance(index, tuple) else (index, ())
+        n = self.unpack_state(self.packed[rows])
+        return n[(Ellipsis,) + columns] if columns else n
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+
+class Simulation:
+    """ numerical part of the simulator, free of any GUI dependency """
+
+    def __init__(self):
+        self.N = 0 # all modes
+        self.W = None
+        self.gamma = None
+        self.P = None
+        self.g = None
+        self.initial_count = None
+        self.n = None
+        self.G = None
+        self.N = 0
+        self.time_step = 0
+        self.time_end = 0
+        self.min_energy = 0
+        self.energy_step = 0
+        self.max_energy = 0
+        self.k = 0
+        self.dynamics_result = None
+        self.populations = None
+        self.spectra = None
+        self.time_resolved_spectra = None
+        self.progress_callback = None
+        self.progress_interval = 0.1 # minimal time between progress reports, s
+        self.last_progress_time = 0
+        self.populations_callback = None # gets new populations while the dynamics are integrated
+        self.pending_populations = []
+        self.last_populations_time = 0
+        self.cancel_requested = False
+        self.rhs_evaluations = 0
+        self.jacobian_evaluations = 0
+        self.uses_solver = False
+        self.steady_index = -1
+        self.cache = None
+        self.dynamics_key = None
+        self.stages = {}
+        self.stage_keys = {}
+
+    def set_config_data(self, config_data):
+        self.config_data = config_data
+        self.setup_parameters()
+
+    def setup_parameters(self):
+        modes = self.load_modes()
+        self.N = len(modes['energy_ev']) + 1  # +1 for excitons
+
+        # Initializing Arrays
+        self.W = np.zeros(self.N) # Energies
+        self.gamma = np.zeros(self.N) # Dampings
+        self.P = np.zeros(self.N) # Pumping
+        self.g = np.zeros(self.N) # Strengths
+        self.initial_count = np.zeros(self.N)
+
+        # For exciton
+        self.W[0] = self.config_data['excitonic_mode']['exciton_energy_ev']
+        self.gamma[0] = self.config_data['excitonic_mode']['damping_ev']
+        self.P[0] = self.config_data['excitonic_mode']['pumping_ev']
+        self.initial_count[0] = self.config_data['excitonic_mode']['initial_excitons']
+
+        # For photons; the optional scales multiply the dampings and strengths of all modes
+        photonic_modes = self.config_data['photonic_modes']
+        self.W[1:] = modes['energy_ev']
+        self.gamma[1:] = modes['damping_ev'] * photonic_modes.get('damping_scale', 1.0)
+        self.P[1:] = modes['pumping_ev']
+        self.g[1:] = modes['strength_ev'] * photonic_modes.get('strength_scale', 1.0)
+        self.initial_count[1:] = modes['initial_photons']
+
+        self.G = self.gamma - self.P
+        self.k = self.config_data['excitonic_mode'].get('interaction_ev', 0) # Exciton-exciton interaction
+
+        # For Dynamic calculations
+        self.time_step = self.config_data['dynamic_configuration']['time_step_ps']
+        self.time_step = self.time_step / HBAR_EV_PS #  convert
+        self.time_end = self.config_data['dynamic_configuration']['time_end_ps']
+        self.time_end = self.time_end / HBAR_EV_PS  # convert
+        self.dynamics_engine = self.config_data['dynamic_configuration'].get('engine', 'ode')
+        self.chunk_steps = self.config_data['dynamic_configuration'].get('chunk_steps', 200)
+        self.store_trajectory = self.config_data['dynamic_configuration'].get('store_trajectory', True)
+        self.population_stride = self.config_data['dynamic_configuration'].get('population_stride', 1)
+        self.solver = self.config_data['dynamic_configuration'].get('solver', 'odeint')
+        self.rtol = self.config_data['dynamic_configuration'].get('rtol', 1.49012e-8)
+        self.atol = self.config_data['dynamic_configuration'].get('atol', 1.49012e-8)
+        self.use_jacobian = self.config_data['dynamic_configuration'].get('jacobian', True)
+        self.use_jit = self.config_data['dynamic_configuration'].get('jit', False) and numba is not None
+        self.stop_population = self.config_data['dynamic_configuration'].get('stop_population')
+        self.stop_tolerance = self.config_data['dynamic_configuration'].get('stop_tolerance')
+
+        # For Spectra calculations
+        self.min_energy = self.config_data['spectra_configuration']['min_energy_ev']
+        self.energy_step = self.config_data['spectra_configuration']['energy_step_ev']
+        self.max_energy = self.config_data['spectra_configuration']['max_energy_ev']
+        self.spectra_engine = self.config_data['spectra_configuration'].get('engine', 'expm')
+        self.chunk_size = self.config_data['spectra_configuration'].get('chunk_size', 256)
+        self.quadrature = self.config_data['spectra_configuration'].get('quadrature', 'rectangle')
+        self.energy_grid = self.config_data['spectra_configuration'].get('grid', 'uniform')
+        self.grid_tolerance = self.config_data['spectra_configuration'].get('tolerance', 1e-3)
+        self.gate = self.config_data['spectra_configuration'].get('gate_ps')
+        self.gate_step = self.config_data['spectra_configuration'].get('gate_step_ps', self.gate)
+
+        # Optional on-disk cache of results
+        cache_config = self.config_data.get('cache')
+        if cache_config:
+            self.cache = ResultCache(cache_config['directory'], cache_config.get('max_size_mb', 1024))
+        else:
+            self.cache = None
+
+    def load_modes(self):
+        """ columns of the photon modes (see source.modes), restricted to energy_window_ev if it is set
+
+        The modes come from the mode table file_modes if it is set, otherwise from the five files of the
+        separate columns when there is more than one mode, otherwise from the single-mode values.
+        """
+        photonic_modes = self.config_data['photonic_modes']
+        number_of_modes = photonic_modes.get('number_of_modes')
+        if photonic_modes.get('file_modes'):
+            modes = load_mode_table(photonic_modes['file_modes'])
+            if number_of_modes is not None and number_of_modes != len(modes['energy_ev']):
+                raise ValueError(f"{photonic_modes['file_modes']} has {len(modes['energy_ev'])} modes, "
+                                 f"but number_of_modes is {number_of_modes}")
+        elif number_of_modes > 1:
+            modes = self.load_from_files(number_of_modes)
+        else:
+            modes = self.load_single_mode()
+
+        window = photonic_modes.get('energy_window_ev')
+        if window:
+            modes = select_modes(modes, *window)
+        return modes
+
+    def load_from_files(self, number_of_modes):
+        photonic_modes = self.config_data['photonic_modes']
+        files = {'energy_ev': 'file_photon_energies', 'damping_ev': 'file_photon_dampings',
+                 'pumping_ev': 'file_photon_pumpings', 'strength_ev': 'file_strengths',
+                 'initial_photons': 'file_initial_photon_counts'}
+        modes = {}
+        for name, key in files.items():
+            modes[name] = np.atleast_1d(np.loadtxt(photonic_modes[key]))
+            check_lengths({name: modes[name]}, number_of_modes, photonic_modes[key])
+        return modes
+
+    def load_single_mode(self):
+        photonic_modes = self.config_data['photonic_modes']
+        return {'energy_ev': np.array([photonic_modes['photon_energy_ev']], dtype=np.float64),
+                'damping_ev': np.array([photonic_modes['damping_ev']], dtype=np.float64),
+                'pumping_ev': np.array([photonic_modes['pumping_ev']], dtype=np.float64),
+                'strength_ev': np.array([photonic_modes['strength_ev']], dtype=np.float64),
+                'initial_photons': np.array([photonic_modes['initial_photons']], dtype=np.float64)}
+
+    def solve(self, x0, t):
+        """ integrate the packed equation of motion from x0 over the times t with the configured solver
+
+        x0 may hold several stacked states (a batch); the solver then integrates them as one flat vector.
+        """
+        shape = x0.shape
+
+        def rhs(t, x):
+            self.report_progress(t / self.time_end * 100)
+            self.rhs_evaluations += 1
+            return self.create_dynamics_matrix(x.reshape(shape), t).ravel()
+
+        def jacobian(t, x):
+            self.jacobian_evaluations += 1
+            return self.dynamics_jacobian(x.reshape(shape), t)
+
+        use_jacobian = self.use_jacobian and self.solver not in EXPLICIT_SOLVERS
+        if self.solver == 'odeint':
+            # odeint only accepts a dense Jacobian
+            states = integrate.odeint(lambda x, t: rhs(t, x), x0.ravel(), t, rtol=self.rtol, atol=self.atol,
+                                      Dfun=(lambda x, t: jacobian(t, x).toarray()) if use_jacobian else None)
+            return states.reshape((len(t),) + shape)
+
+        options = {}
+        if use_jacobian:
+            # LSODA, like odeint, only accepts a dense Jacobian
+            options['jac'] = (lambda t, x: jacobian(t, x).toarray()) if self.solver == 'LSODA' else jacobian
+        solution = integrate.solve_ivp(rhs, (t[0], t[-1]), x0.ravel(), method=self.solver, t_eval=t, rtol=self.rtol,
+                                       atol=self.atol, **options)
+        if not solution.success:
+            raise RuntimeError(f"Integration failed: {solution.message}")
+        return solution.y.T.reshape((len(t),) + shape)
+
+    def solver_report(self):
+        """ how the last dynamics were obtained and how many RHS and Jacobian evaluations they took """
+        report = {'solver': self.solver if self.uses_solver else self.dynamics_engine,
+                  'rhs_evaluations': self.rhs_evaluations, 'jacobian_evaluations': self.jacobian_evaluations,
+                  'end_time_ps': self.all_time[-1] * HBAR_EV_PS}
+        if self.steady_index >= 0:
+            report['steady_state_ps'] = self.create_time_grid()[self.steady_index] * HBAR_EV_PS
+        return report
+
+    def prepare_packing(self):
+        """ index maps between the full correlation matrix and its packed form
+
+        n is Hermitian, so only its upper triangle is integrated: the N(N+1)/2 complex values n[i][j], i <= j,
+        row by row starting with row 0, stored as a float64 array of real and imaginary parts.
+        """
+        rows, columns = np.triu_indices(self.N)
+        self.upper_rows, self.upper_columns = rows, columns
+        self.flat_upper = rows * self.N + columns
+        self.flat_lower = columns * self.N + rows
+        self.off_diagonal = rows != columns
+        self.packed_diagonal = np.flatnonzero(rows == columns)
+
+    def pack_state(self, n):
+        """ packed form of full (flattened) correlation matrices, along the last axis """
+        return np.ascontiguousarray(n[..., self.flat_upper]).view(np.float64)
+
+    def unpack_state(self, x):
+        """ full (flattened) correlation matrices from their packed form, along the last axis """
+        u = np.ascontiguousarray(x).view(np.complex128)
+        n = np.empty(shape=u.shape[:-1] + (self.N * self.N,), dtype=np.complex128)
+        n[..., self.flat_lower] = np.conj(u)
+        n[..., self.flat_upper] = u
+        return n
+
+    def prepare_dynamics_kernel(self):
+        """ precompute the constant parts of the equation of motion """
+        self.prepare_packing()
+        # detuning and damping of every correlation n[i][j] of the upper triangle
+        self.L = 1j * (self.W[self.upper_rows] - self.W[self.upper_columns]) \
+            - (self.G[..., self.upper_rows] + self.G[..., self.upper_columns]) / 2
+        self.ig = 1j * self.g
+        self.ig_rows = self.ig[self.upper_rows]
+        self.ig_columns = self.ig[self.upper_columns]
+        # np.dot(self.ig, n) from the triangle and its conjugate, for stacks of states
+        size = len(self.flat_upper)
+        off_diagonal = np.flatnonzero(self.off_diagonal)
+        self.coupling_upper = sparse.csr_matrix((self.ig_rows, (self.upper_columns, np.arange(size))),
+                                                shape=(self.N, size))
+        self.coupling_lower = sparse.csr_matrix((self.ig_columns[off_diagonal],
+                                                 (self.upper_rows[off_diagonal], off_diagonal)), shape=(self.N, size))
+
+    def create_dynamics_matrix(self, x, t):
+        """ right-hand side of the equation of motion for the packed upper triangle of the correlation matrix
+
+        x is one packed state or a stack of them along the first axis.
+        """
+        u = np.ascontiguousarray(x).view(np.complex128)
+        if self.use_jit and u.ndim == 1:
+            return packed_dynamics(u, self.L, self.ig, self.P, self.k, self.N).view(np.float64)
+
+        # the first N entries of the triangle are row 0
+        row = u[..., :self.N]
+
+        V = self.L * u
+        # coupling commutator with the star-shaped g vector (the exciton couples to every photonic mode)
+        V += self.ig_rows * row[..., self.upper_columns] - self.ig_columns * np.conj(row)[..., self.upper_rows]
+        # the triangle is the lower packed storage of n^T, so this is np.dot(self.ig, n)
+        if u.ndim == 1:
+            V[:self.N] += blas.zhpmv(self.N, 1, u, self.ig, lower=1)
+        else:
+            V[:, :self.N] += (self.coupling_upper @ u.T + self.coupling_lower @ np.conj(u).T).T
+        V[..., 0] -= np.dot(row, self.ig)
+        # the diagonal stays real
+        V[..., self.packed_diagonal] = V[..., self.packed_diagonal].real + self.P
+        V[..., 1:self.N] += 2j * self.k * row[..., :1] * row[..., 1:]
+        return V.view(np.float64)
+
+    def realify(self, A):
+        """ real matrix acting on interleaved (real, imaginary) pairs that applies the complex matrix A """
+        A = sparse.csr_matrix(A)
+        return sparse.kron(A.real, [[1, 0], [0, 1]]) + sparse.kron(A.imag, [[0, -1], [1, 0]])
+
+    def prepare_jacobian(self):
+        """ sparse Jacobian of create_dynamics_matrix for k = 0, which is constant """
+        K = sparse.csr_matrix(self.create_generator())
+        identity = sparse.identity(self.N, format='csr')
+        # row-major vec(K n + n K^H) = (K x I + I x conj(K)) vec(n)
+        J = self.realify(sparse.kron(K, identity) + sparse.kron(identity, K.conj()))
+
+        # maps between the packed state and the interleaved real view of the full matrix
+        size = len(self.flat_upper)
+        upper = np.arange(size)
+        lower = upper[self.off_diagonal]
+        # the imaginary parts of the diagonal are kept at zero, so they are left out
+        unpack_rows = np.concatenate([2 * self.flat_upper, 2 * self.flat_upper[lower] + 1,
+                                      2 * self.flat_lower[lower], 2 * self.flat_lower[lower] + 1])
+        unpack_columns = np.concatenate([2 * upper, 2 * lower + 1, 2 * lower, 2 * lower + 1])
+        signs = np.concatenate([np.ones(size + 2 * len(lower)), -np.ones(len(lower))])
+        unpack = sparse.csr_matrix((signs, (unpack_rows, unpack_columns)), shape=(2 * self.N * self.N, 2 * size))
+        pack_rows = np.concatenate([2 * upper, 2 * lower + 1])
+        pack_columns = np.concatenate([2 * self.flat_upper, 2 * self.flat_upper[lower] + 1])
+        pack = sparse.csr_matrix((np.ones(len(pack_rows)), (pack_rows, pack_columns)),
+                                 shape=(2 * size, 2 * self.N * self.N))
+        self.jacobian_linear = (pack @ J @ unpack).tocsr()
+
+    def dynamics_jacobian(self, x, t):
+        """ sparse Jacobian of create_dynamics_matrix at the packed state x """
+        if self.k == 0:
+            return self.jacobian_linear
+
+        # exciton-exciton term 2j * k * n[0][0] * n[0][i] of the rows n[0][i]
+        row = np.ascontiguousarray(x[:2 * self.N]).view(np.complex128)
+        rows = np.arange(1, self.N)
+        values = np.concatenate([2j * self.k * row[1:], np.full(self.N - 1, 2j * self.k * row[0])])
+        size = len(self.flat_upper)
+        nonlinear = sparse.csr_matrix((values, (np.tile(rows, 2), np.concatenate([np.zeros_like(rows), rows]))),
+                                      shape=(size, size))
+        return self.jacobian_linear + self.realify(nonlinear)
+
+    def create_dynamics_matrix_reference(self, n, t):
+        """ element-by-element version of create_dynamics_matrix on the full matrix, kept as a reference implementation """
+        V = np.zeros(shape=(self.N * self.N), dtype=np.complex128);
+        V[0] = self.P[0] - self.G[0] * n[0] + 1j * sum([self.g[i] * (n[self.N * i] - n[i]) for i in range(1, self.N)])
+        for i in range(1, self.N):
+            V[i] = 1j * (self.W[0] - self.W[i]) * n[i] - 1j * self.g[i] * n[0] - (self.G[0] + self.G[i]) / 2 * n[i] \
+                   + 1j * sum([self.g[j] * n[j * self.N + i] for j in range(1, self.N)]) + 2 * 1j * self.k * n[0] * n[i]
+            V[i * self.N] = np.conj(V[i])
+            for j in range(1, self.N):
+                V[self.N * i + j] = 1j * (self.W[i] - self.W[j]) * n[self.N * i + j] - 1j * self.g[j] * n[self.N * i] + 1j * self.g[i] * n[j] \
+                                    - (self.G[i] + self.G[j]) / 2 * n[self.N * i + j] + (self.P[i] if (i == j) else 0)
+        return V
+
+    def create_generator(self):
+        """ matrix K of the linear (k = 0) equation of motion dn/dt = K n + n K^H + diag(P) """
+        H = np.diag(self.W).astype(np.complex128)
+        H[0, 1:] = self.g[1:]
+        H[1:, 0] = self.g[1:]
+        return 1j * H - np.diag(self.G) / 2
+
+    def create_linear_step(self, dt):
+        """ one step n -> U n U^H + Q of the exact solution of the linear equation of motion
+
+        U = expm(K dt) and the pumping Q accumulated over dt are both obtained from a single matrix exponential
+        (Van Loan's block method).
+        """
+        K = self.create_generator()
+        C = np.zeros(shape=(2 * self.N, 2 * self.N), dtype=np.complex128)
+        C[:self.N, :self.N] = -K
+        C[:self.N, self.N:] = np.diag(self.P)
+        C[self.N:, self.N:] = K.conj().T
+        E = scl.expm(C * dt)
+        U = E[self.N:, self.N:].conj().T
+        Q = np.dot(U, E[:self.N, self.N:])
+        return U, Q
+
+    def propagate_linear(self, n0, count, U, Q):
+        """ the count states following n0 on a uniform time grid
+
+        n0, U and Q may also be stacks of states and steps along the first axis, which are then propagated
+        together by one batched matrix product per step.
+        """
+        Uh = np.conj(np.swapaxes(U, -1, -2))
+        n = n0.reshape(n0.shape[:-1] + (self.N, self.N))
+        result = np.zeros(shape=(count,) + n.shape, dtype=np.complex128)
+        for i in range(count):
+            n = np.matmul(np.matmul(U, n), Uh) + Q
+            result[i] = n
+        return result.reshape((count,) + n0.shape)
+
+    def emd(self, M, D, t):
+        return (np.dot(scl.expm(M * t), D)).trace()
+
+    def diagonalize(self, M, D):
+        """ eigenvalues of M and weights c such that trace(expm(M t) D) = sum(c * exp(eigenvalues * t))
+
+        D may be a stack of matrices, the weights are then stacked the same way.
+        Returns None when M is (numerically) defective and has no reliable eigenbasis.
+        """
+        eigenvalues, V = np.linalg.eig(M)
+        if np.linalg.cond(V) > 1e10:
+            return None
+        weights = np.sum(np.linalg.solve(V, D) * V.T, axis=-1)
+        return eigenvalues, weights
+
+    def spectrum_from_eigenvalues(self, eigenvalues, weights, energies):
+        """ sum over the time grid of trace(expm(M t) D) * exp(1j * E * t) * time_step in closed form
+
+        weights may hold one column per D, giving one spectrum per column. Each eigenvalue contributes a finite geometric series over the uniform time grid, which for an
+        infinite grid reduces to the complex Lorentzian -c / (eigenvalue + 1j * E).
+        """
+        dt = self.lag_time[1] - self.lag_time[0]
+        r = np.exp(np.add.outer(1j * energies, eigenvalues) * dt)
+        one_minus_r = 1 - r
+        degenerate = np.abs(one_minus_r) < 1e-14
+        series = np.where(degenerate, len(self.lag_time),
+                          (1 - r ** len(self.lag_time)) / np.where(degenerate, 1, one_minus_r))
+        return np.dot(series, weights) * self.time_step
+
+    def create_time_grid(self):
+        return np.linspace(0, self.time_end, int(self.time_end / self.time_step) + 1)
+
+    def create_energy_interval(self):
+        return np.linspace(self.min_energy, self.max_energy, int((self.max_energy - self.min_energy) / self.energy_step) + 1)
+
+    def load_cached(self, key):
+        if self.cache is None:
+            return None
+        return self.cache.load(key)
+
+    def save_cached(self, key, **arrays):
+        if self.cache is not None:
+            self.cache.save(key, **arrays)
+
+    def start_progress(self, progress_callback):
+        # cancel_requested is not reset here but by whoever starts the calculation (reset_cancel), so that a
+        # cancel that arrives before a background calculation reaches this point is not lost
+        self.progress_callback = progress_callback
+        self.last_progress_time = 0
+
+    def report_progress(self, value):
+        """ pass the progress to the callback at most once per progress_interval, stop if cancelled """
+        if self.cancel_requested:
+            raise CalculationCancelled()
+        if self.progress_callback is not None:
+            now = time.monotonic()
+            if now - self.last_progress_time >= self.progress_interval or value >= 100:
+                self.last_progress_time = now
+                self.progress_callback(value)
+
+    def report_populations(self, populations):
+        """ pass the populations of the last steps to populations_callback, gathered over progress_interval
+
+        The blocks follow each other on population_time_grid, starting at its first point.
+        """
+        if self.populations_callback is None:
+            return
+        self.pending_populations.append(populations)
+        now = time.monotonic()
+        if now - self.last_populations_time >= self.progress_interval:
+            self.last_populations_time = now
+            self.populations_callback(np.concatenate(self.pending_populations))
+            self.pending_populations = []
+
+    def cancel(self):
+        """ stop the running calculation at its next progress report; safe to call from another thread """
+        self.cancel_requested = True
+
+    def reset_cancel(self):
+        """ forget an earlier cancel; call before starting a calculation """
+        self.cancel_requested = False
+
+    def compute_equations_key(self):
+        """ hash of everything the dynamics depend on apart from the initial counts and the pumping """
+        streaming = (self.population_stride, self.quadrature) if self.streams_dynamics() else ()
+        solver = (self.solver, self.rtol, self.atol, self.use_jacobian)
+        termination = (self.stop_population, self.stop_tolerance)
+        return make_key(ENGINE_VERSION, self.N, self.W, self.gamma, self.g, self.k, self.create_time_grid(),
+                        self.dynamics_engine, self.chunk_steps, streaming, solver, termination)
+
+    def compute_dynamics_key(self):
+        """ hash of everything the dynamics depend on """
+        return make_key(self.compute_equations_key(), self.initial_count, self.P)
+
+    def is_dynamics_current(self):
+        """ whether the stored dynamics were calculated with the current parameters """
+        return self.dynamics_key is not None and self.dynamics_key == self.compute_dynamics_key()
+
+    def run_stage(self, name, key, compute):
+        """ arrays produced by a pipeline stage, recomputed only when the key of its inputs changes """
+        if self.stage_keys.get(name) != key:
+            arrays = self.load_cached(key)
+            if arrays is None:
+                arrays = compute()
+                self.save_cached(key, **arrays)
+            self.stages[name] = arrays
+            self.stage_keys[name] = key
+        return self.stages[name]
+
+    def has_stage(self, name, key):
+        """ whether run_stage(name, key, ...) would return without computing """
+        return self.stage_keys.get(name) == key or (self.cache is not None and self.cache.contains(key))
+
+    def seed_stage(self, name, key, arrays):
+        """ store arrays computed elsewhere, e.g. in a batch, as the result of a pipeline stage """
+        self.save_cached(key, **arrays)
+        self.stages[name] = arrays
+        self.stage_keys[name] = key
+
+    def calculate_dynamics(self, progress_callback=None):
+        """ solving the equation of motion of the coupled system"""
+
+        self.start_progress(progress_callback)
+        self.pending_populations = []
+        self.last_populations_time = 0
+        self.spectra = None
+        self.time_resolved_spectra = None
+        self.all_time = self.create_time_grid()
+        self.rhs_evaluations = 0
+        self.jacobian_evaluations = 0
+        self.uses_solver = False
+        self.prepare_packing()
+
+        # the key is set only once the dynamics are complete, so that a cancelled or failed run does not mark
+        # the dynamics of the previous parameters as current
+        self.dynamics_key = None
+        dynamics_key = self.compute_dynamics_key()
+        dynamics = self.run_stage('dynamics', dynamics_key, self.integrate_dynamics)
+
+        self.report_progress(100)
+
+        # integration may have stopped early (decayed populations) or continued analytically (steady state)
+        self.all_time = self.all_time[:int(dynamics['end_index'])]
+        self.steady_index = int(dynamics['steady_index'])
+        if 'dynamics' in dynamics:
+            # packed states, see prepare_packing
+            self.dynamics_result = dynamics['dynamics']
+            self.populations = self.dynamics_result[:, 2 * self.packed_diagonal]
+        else:
+            self.dynamics_result = None
+            self.populations = dynamics['populations']
+        self.time_for_graph = self.population_time_grid()[:len(self.populations)] * HBAR_EV_S # reverse conference in s
+        self.dynamics_key = dynamics_key
+
+    def population_time_grid(self):
+        """ times at which populations are kept: every step, or every population_stride-th step when streaming """
+        if not self.streams_dynamics():
+            return self.create_time_grid()
+        return self.create_time_grid()[::self.population_stride]
+
+    def streams_dynamics(self):
+        """ whether only populations and time integrals are kept instead of the full trajectory """
+        return not self.store_trajectory or self.dynamics_engine in ('star', 'steady')
+
+    def iterate_dynamics(self, x0):
+        """ integrate the equation of motion chunk by chunk, yielding (index of the first state, packed states) """
+        yield 0, x0[None]
+
+        # the propagator needs linear equations (k = 0) and a uniform time grid; it also serves the star engine
+        # where that does not apply (pumping)
+        linear = self.dynamics_engine in ('propagator', 'star') and self.k == 0 and len(self.all_time) > 1 \
+            and np.allclose(np.diff(self.all_time), self.all_time[1] - self.all_time[0])
+        if linear:
+            U, Q = self.create_linear_step(self.all_time[1] - self.all_time[0])
+        else:
+            self.uses_solver = True
+            if self.use_jacobian:
+                self.prepare_jacobian()
+
+        x = x0
+        for start in range(1, len(self.all_time), self.chunk_steps):
+            stop = min(start + self.chunk_steps, len(self.all_time))
+            if linear:
+                states = self.pack_state(self.propagate_linear(self.unpack_state(x), stop - start, U, Q))
+                self.report_progress(stop / len(self.all_time) * 100)
+            else:
+                states = self.solve(x, self.all_time[start - 1:stop])[1:]
+            x = states[-1]
+            yield start, states
+
+    def integrate_dynamics(self):
+        """ the full trajectory, or when streaming only int_n and the (decimated) populations """
+        if self.star_engine_active():
+            return self.integrate_star_dynamics()
+        if self.steady_engine_active():
+            return self.integrate_steady_state()
+
+        self.n = np.zeros(shape=self.initial_count.shape[:-1] + (self.N * self.N,), dtype=np.complex128)
+        self.n[..., ::self.N + 1] = self.initial_count
+
+        self.prepare_dynamics_kernel()
+        x0 = self.pack_state(self.n)
+
+        # accumulate the time integral on the fly, with the same weights as integrate_correlations
+        count = len(self.all_time)
+        weights = self.quadrature_weights(count)
+        int_x = np.zeros(shape=x0.shape)
+        chunks = []
+        x = x0
+        stop, reason = count, None
+        for start, states in self.iterate_dynamics(x0):
+            contribution = np.tensordot(weights[start:start + len(states)], states, axes=1)
+            int_x += contribution
+            if self.streams_dynamics():
+                first = -start % self.population_stride
+                chunks.append(states[first::self.population_stride, ..., 2 * self.packed_diagonal])
+                self.report_populations(chunks[-1])
+            else:
+                chunks.append(states)
+                self.report_populations(states[..., 2 * self.packed_diagonal])
+            if start and start + len(states) < count and len(states) > 2:
+                reason = self.convergence(states[-1], x, contribution, int_x)
+                if reason is not None:
+                    stop = start + len(states)
+                    break
+            x = states[-1]
+
+        steady_index = -1
+        if reason == 'decayed':
+            # the integration rule of the shortened grid differs from the full one only in its last points
+            int_x += np.tensordot(self.quadrature_weights(stop)[-3:] - weights[stop - 3:stop], states[-3:], axes=1)
+        elif reason == 'steady':
+            steady_index = stop - 1
+            x = self.steady_state(states[-1])
+            int_x += weights[stop:].sum() * x
+            if self.streams_dynamics():
+                tail = len(range(-stop % self.population_stride, count - stop, self.population_stride))
+                chunks.append(np.broadcast_to(x[..., 2 * self.packed_diagonal], (tail,) + x[..., 2 * self.packed_diagonal].shape))
+            else:
+                chunks.append(np.broadcast_to(x, (count - stop,) + x.shape))
+            stop = count
+
+        result = {'end_index': np.array(stop), 'steady_index': np.array(steady_index)}
+        if not self.streams_dynamics():
+            result['dynamics'] = np.concatenate(chunks)
+            return result
+        result['int_n'] = self.unpack_state(int_x).reshape(int_x.shape[:-1] + (self.N, self.N))
+        result['populations'] = np.concatenate(chunks)
+        return result
+
+    def convergence(self, x, previous, contribution, int_x):
+        """ why the integration can stop after a chunk that ended in the packed state x, or None
+
+        'decayed': without pumping, the total population fell below stop_population or the chunk changed int_n
+        by less than stop_tolerance relative to it. 'steady': with pumping, the state changed by less than
+        stop_tolerance relative to itself since the end of the previous chunk.
+        """
+        pumped = np.any(self.P != 0, axis=-1)
+        decayed = np.zeros(shape=pumped.shape, dtype=bool)
+        if self.stop_population is not None:
+            decayed |= x[..., 2 * self.packed_diagonal].sum(axis=-1) <= self.stop_population
+        if self.stop_tolerance is not None:
+            decayed |= np.linalg.norm(contribution, axis=-1) <= self.stop_tolerance * np.linalg.norm(int_x, axis=-1)
+            steady = np.linalg.norm(x - previous, axis=-1) <= self.stop_tolerance * np.linalg.norm(x, axis=-1)
+        else:
+            steady = np.zeros(shape=pumped.shape, dtype=bool)
+
+        if not np.any(pumped) and np.all(decayed):
+            return 'decayed'
+        if np.any(pumped) and np.all(steady | (decayed & ~pumped)):
+            return 'steady'
+        return None
+
+    def steady_state(self, x):
+        """ packed stationary state of the pumped system, which the integration approached with the state x
+
+        For linear equations (k = 0) it is the solution of K n + n K^H + diag(P) = 0; with the exciton-exciton
+        interaction the converged state x itself is kept.
+        """
+        if self.k != 0:
+            return x
+        return self.stationary_state()
+
+    def stationary_state(self):
+        """ packed solution n of the stationary linear equations K n + n K^H + diag(P) = 0 (a Lyapunov equation) """
+        K = self.create_generator()
+        if np.any(np.linalg.eigvals(K).real >= 0):
+            raise ValueError("The pumping exceeds the damping of a mode, so there is no steady state")
+        n = scl.solve_continuous_lyapunov(K, -np.diag(self.P).astype(np.complex128))
+        return self.pack_state(n.ravel())
+
+    def steady_engine_active(self):
+        """ whether the stationary state is solved for directly, which needs linear equations (k = 0) """
+        return self.dynamics_engine == 'steady' and self.k == 0
+
+    def integrate_steady_state(self):
+        """ the stationary state of the pumped system instead of the integrated dynamics
+
+        The spectrum depends on int_n only through int_n divided by its photon populations, so for a system that
+        stays in its stationary state the stationary state itself takes the place of int_n. The populations
+        keep their stationary values over the whole time grid.
+        """
+        if not np.all(np.any(self.P != 0, axis=-1)):
+            raise ValueError("The steady-state engine needs a pumped exciton or photon mode")
+        self.prepare_packing()
+        x = self.stationary_state()
+        populations = x[..., 2 * self.packed_diagonal]
+        count = len(self.all_time)
+        return {'int_n': self.unpack_state(x).reshape(x.shape[:-1] + (self.N, self.N)),
+                'populations': np.broadcast_to(populations, (len(self.population_time_grid()),) + populations.shape),
+                'end_index': np.array(count), 'steady_index': np.array(0)}
+
+    def star_engine_active(self):
+        """ whether the many-mode star engine applies: linear equations (k = 0) without pumping on a uniform
+        time grid. Pumped populations would need time integrals of the amplitude densities that the engine
+        cannot take exactly, so pumped configs fall back to the propagator """
+        return self.dynamics_engine == 'star' and self.k == 0 and not np.any(self.P) and len(self.all_time) > 1 \
+            and np.allclose(np.diff(self.all_time), self.all_time[1] - self.all_time[0])
+
+    def prepare_star_step(self, dt):
+        """ shift, substeps and Taylor order for applying expm(K dt) to amplitude vectors in O(N) """
+        d = 1j * self.W - self.G / 2
+        # centering the diagonal keeps the series short even though the energies themselves are large
+        self.star_shift = (d.real.max() + d.real.min()) / 2 + 1j * (d.imag.max() + d.imag.min()) / 2
+        self.star_diagonal = d - self.star_shift
+        self.star_coupling = 1j * self.g[1:]
+        # bound of the 2-norm of K - shift; the star coupling is a symmetric rank-two matrix of norm |g|
+        norm = np.abs(self.star_diagonal).max() + np.linalg.norm(self.g[1:])
+        self.star_substeps = max(1, int(np.ceil(norm * dt / 0.5)))
+        self.star_h = dt / self.star_substeps
+        self.star_phase = np.exp(self.star_shift * self.star_h)
+
+        # the lowest order whose Taylor remainder is below double precision
+        theta = norm * self.star_h
+        self.star_order, term = 0, 1.0
+        while term * np.exp(theta) > 1e-16:
+            self.star_order += 1
+            term *= theta / self.star_order
+
+    def star_matvec(self, y):
+        """ (K - shift) y for amplitudes y of shape (N, sources) """
+        Ky = self.star_diagonal[:, None] * y
+        Ky[0] += np.dot(self.star_coupling, y[1:])
+        Ky[1:] += self.star_coupling[:, None] * y[0]
+        return Ky
+
+    def star_step(self, y):
+        """ expm(K dt) y, summing the Taylor series on every substep """
+        for _ in range(self.star_substeps):
+            term = y
+            y = y.copy()
+            for p in range(1, self.star_order + 1):
+                term = self.star_matvec(term) * (self.star_h / p)
+                y += term
+            y *= self.star_phase
+        return y
+
+    def propagate_star(self, y, count):
+        """ y and the count - 1 amplitudes following it on the time grid """
+        states = np.zeros(shape=(count,) + y.shape, dtype=np.complex128)
+        states[0] = y
+        for i in range(1, count):
+            states[i] = self.star_step(states[i - 1])
+        return states
+
+    def integrate_star_dynamics(self):
+        """ populations and spectral correlation of many modes from the amplitudes of the excited modes
+
+        For k = 0, no pumping and the diagonal initial state, n(t) = sum_m n0_m u_m u_m^H with
+        u_m(t) = expm(K t) e_m, so only one amplitude vector per initially populated mode is integrated, and
+        each step costs O(N) thanks to the star coupling. Instead of int_n, the spectrum gets
+        trace(expm(M t) D) directly: as K is complex symmetric, it is the m-th entry of expm(K t) b_m, summed
+        over the modes m, with b_m = sum_s w_s expm(K s) conj(u_m(s)) (without the exciton entry).
+        b_m is accumulated backwards (Horner's scheme) over chunks recomputed from checkpoints.
+        """
+        count = len(self.all_time)
+        dt = self.all_time[1] - self.all_time[0]
+        self.prepare_star_step(dt)
+
+        sources = np.flatnonzero(self.initial_count != 0)
+        columns = np.arange(len(sources))
+        weights = self.quadrature_weights(count)
+        source_weights = np.outer(weights, self.initial_count[sources])
+
+        starts = range(0, count, self.chunk_steps)
+        u = np.zeros(shape=(self.N, len(sources)), dtype=np.complex128)
+        u[sources, columns] = 1
+        checkpoints = []
+        photon_sum = 0
+        populations = []
+        for start in starts:
+            stop = min(start + self.chunk_steps, count)
+            checkpoints.append(u)
+            states = self.propagate_star(u, stop - start)
+
+            chunk_populations = np.dot(np.abs(states) ** 2, self.initial_count[sources])
+            photon_sum += np.dot(weights[start:stop], chunk_populations[:, 1:].sum(axis=1))
+            populations.append(chunk_populations[-start % self.population_stride::self.population_stride])
+            self.report_populations(populations[-1])
+
+            if stop < count:
+                u = self.star_step(states[-1])
+            self.report_progress(stop / count * 100 / 3)
+
+        b = np.zeros(shape=u.shape, dtype=np.complex128)
+        for start, u in reversed(list(zip(starts, checkpoints))):
+            stop = min(start + self.chunk_steps, count)
+            states = np.conj(self.propagate_star(u, stop - start))
+            states[:, 0] = 0
+            for i in reversed(range(stop - start)):
+                b = self.star_step(b) + source_weights[start + i] * states[i]
+            self.report_progress((2 - start / count) * 100 / 3)
+
+        correlation = np.zeros(shape=count, dtype=np.complex128)
+        for start in starts:
+            stop = min(start + self.chunk_steps, count)
+            states = self.propagate_star(b, stop - start)
+            correlation[start:stop] = states[:, sources, columns].sum(axis=1)
+            if stop < count:
+                b = self.star_step(states[-1])
+            self.report_progress((2 + stop / count) * 100 / 3)
+
+        return {'populations': np.concatenate(populations), 'correlation': np.conj(correlation) / (np.pi * photon_sum),
+                'end_index': np.array(count), 'steady_index': np.array(-1)}
+
+    def calculate_spectra(self, progress_callback=None):
+        """ Calculate Spectra
+
+        Every stage (integrated correlations, spectral kernel, evaluation on the energy grid) is reused
+        as long as its inputs are unchanged, so changing only the energy grid repeats only the evaluation.
+        With the adaptive grid, energy_interval is the non-uniform grid chosen by refine_spectra.
+        """
+        if not self.is_dynamics_current():
+            raise RuntimeError("The dynamics are out of date, calculate the dynamics first")
+
+        self.start_progress(progress_callback)
+        self.energy_interval = self.create_energy_interval()
+        kernel, kernel_key = self.spectral_kernel()
+
+        if self.energy_grid == 'adaptive':
+            spectra_key = make_key(kernel_key, self.energy_grid, self.min_energy, self.max_energy, self.energy_step,
+                                   self.grid_tolerance)
+        else:
+            spectra_key = make_key(kernel_key, self.energy_interval)
+
+        if self.energy_grid == 'adaptive':
+            spectra = self.run_stage('spectra', spectra_key, lambda: self.refine_spectra(kernel))
+            self.energy_interval = spectra['energy']
+        else:
+            spectra = self.run_stage('spectra', spectra_key, lambda: self.evaluate_spectra(kernel, self.energy_interval))
+        self.spectra = spectra['spectra']
+
+        self.time_resolved_spectra = None
+        if self.gate:
+            if self.dynamics_result is None:
+                raise RuntimeError("Time-resolved spectra need the stored trajectory (store_trajectory: true)")
+            time_resolved_key = make_key(kernel_key, self.gate, self.gate_step, self.create_energy_interval())
+            time_resolved = self.run_stage('time_resolved', time_resolved_key,
+                                           lambda: self.create_time_resolved_spectra(self.stages['int_n']['int_n']))
+            self.gate_times = time_resolved['time']
+            self.gate_energies = time_resolved['energy']
+            self.time_resolved_spectra = time_resolved['spectra']
+
+        self.report_progress(100)
+
+    def spectral_kernel(self):
+        """ the kernel of the spectrum of the current dynamics (see create_spectral_kernel) and its key """
+        # the spectrum always uses the full time grid, even when the dynamics stopped early
+        self.lag_time = self.create_time_grid()
+        int_n_key = make_key(self.dynamics_key, self.quadrature)
+        kernel_key = make_key(int_n_key, self.spectra_engine)
+
+        if 'correlation' in self.stages['dynamics']:
+            # the star engine yields trace(expm(M t) D) on the time grid directly
+            return {'int_emd': self.stages['dynamics']['correlation']}, kernel_key
+        int_n = self.run_stage('int_n', int_n_key, self.integrate_correlations)['int_n']
+        return self.run_stage('kernel', kernel_key, lambda: self.create_spectral_kernel(int_n)), kernel_key
+
+    def spectrum_at(self, energies):
+        """ the spectrum of the current dynamics at any energies, such as those of a measurement """
+        if not self.is_dynamics_current():
+            raise RuntimeError("The dynamics are out of date, calculate the dynamics first")
+        kernel, _ = self.spectral_kernel()
+        return self.evaluate_spectra(kernel, energies)['spectra']
+
+    def preview_spectrum(self, energies):
+        """ fast approximation of the spectrum for interactive previews, without any dynamics
+
+        Takes the linear equations (k = 0) over an infinite time window: the time integral of n is then the
+        solution of K X + X K^H = -n(0), or with pumping the stationary state takes its place, and the
+        spectrum is the closed-form resolvent -trace((M + iE)^-1 D) instead of a sum over the time grid.
+        """
+        if np.any(self.P != 0):
+            self.prepare_packing()
+            n = self.unpack_state(self.stationary_state()).reshape(self.N, self.N)
+        else:
+            n = scl.solve_continuous_lyapunov(self.create_generator(), -np.diag(self.initial_count).astype(np.complex128))
+
+        D = np.zeros(shape=(self.N, self.N), dtype=np.complex128)
+        D[:, 1:] = n[1:, :].T / (np.pi * (np.trace(n) - n[0][0]))
+        M = self.create_spectral_matrix()
+        decomposition = self.diagonalize(M, D)
+        if decomposition is not None:
+            eigenvalues, weights = decomposition
+            return -np.dot(1 / np.add.outer(1j * energies, eigenvalues), weights)
+        resolvents = np.linalg.inv(M + 1j * energies[:, None, None] * np.eye(self.N))
+        return -np.einsum('eab,ba->e', resolvents, D)
+
+    def integrate_correlations(self):
+        """ time integral of the matrix of all numbers of particles """
+        if self.streams_dynamics():
+            # already accumulated while integrating
+            return {'int_n': self.stages['dynamics']['int_n']}
+        weights = self.quadrature_weights(len(self.dynamics_result))
+        return {'int_n': self.unpack_state(np.dot(weights, self.dynamics_result)).reshape(self.N, self.N)}
+
+    def create_spectral_kernel(self, int_n):
+        """ everything the spectrum needs apart from the energies: the eigenvalues and weights of M,
+        or trace(expm(M t) D) on the time grid when M cannot be diagonalized """
+
+        # ratio
+        sum = np.trace(int_n) - int_n[0][0]
+
+        D = np.zeros(shape=(self.N, self.N), dtype=np.complex128)
+        D[:, 1:] = int_n[1:, :].T / (np.pi * sum)
+
+        M = self.create_spectral_matrix()
+
+        if self.spectra_engine == 'eigen' and len(self.lag_time) > 1:
+            decomposition = self.diagonalize(M, D)
+            if decomposition is not None:
+                return {'eigenvalues': decomposition[0], 'weights': decomposition[1]}
+
+        int_emd = np.zeros(shape=(int(self.time_end / self.time_step) + 1), dtype=np.complex128)
+        for i in range(len(self.lag_time)):
+            int_emd[i] = self.emd(M,  D, self.lag_time[i])
+            self.report_progress(i / len(self.lag_time) * 100)
+        return {'int_emd': int_emd}
+
+    def create_spectral_matrix(self):
+        """ matrix M = conj(K) of the time evolution of the correlations in trace(expm(M t) D) """
+        M = np.zeros(shape=(self.N, self.N), dtype=np.complex128)
+        M[0][0] = -1j * self.W[0] - self.G[0] / 2
+        for i in range(1, self.N):
+            M[i][i] = -1j * self.W[i] - self.G[i] / 2
+            M[0][i] = -1j * self.g[i]
+            M[i][0] = -1j * self.g[i]
+        return M
+
+    def peak_energies(self, kernel):
+        """ energies around the lines of the spectrum: the centre of every eigenvalue of M in the energy window
+        and points at 0.5, 1, 2 and 4 half widths on both sides """
+        if 'eigenvalues' in kernel:
+            eigenvalues = kernel['eigenvalues']
+        else:
+            eigenvalues = np.linalg.eigvals(self.create_spectral_matrix())
+        # an eigenvalue -1j * E0 - w contributes a Lorentzian centred at E0 with half width w
+        centres = -eigenvalues.imag
+        widths = np.maximum(-eigenvalues.real, self.energy_step)
+        offsets = np.array([0, -0.5, 0.5, -1, 1, -2, 2, -4, 4])
+        energies = (centres[:, None] + widths[:, None] * offsets).ravel()
+        return energies[(energies >= self.min_energy) & (energies <= self.max_energy)]
+
+    def refine_spectra(self, kernel):
+        """ the spectrum on a non-uniform energy grid, refined where it is not yet linear
+
+        Starts from a coarse grid and the peak_energies, then keeps halving every interval whose midpoint
+        differs from the linear interpolation of its ends by more than tolerance times the maximum of the
+        spectrum, down to energy_step. Every evaluated energy is part of the result.
+        """
+        evaluate = lambda energies: self.evaluate_spectra(kernel, energies)['spectra']
+        energies = np.unique(np.concatenate([np.linspace(self.min_energy, self.max_energy, 33),
+                                             self.peak_energies(kernel)]))
+        values = evaluate(energies)
+        active = np.ones(len(energies) - 1, dtype=bool)
+        while True:
+            active &= np.diff(energies) >= 2 * self.energy_step
+            left = np.flatnonzero(active)
+            if len(left) == 0:
+                break
+            middles = (energies[left] + energies[left + 1]) / 2
+            middle_values = evaluate(middles)
+            error = np.abs(middle_values - (values[left] + values[left + 1]) / 2)
+            scale = max(np.abs(values).max(), np.abs(middle_values).max())
+            refine = error > self.grid_tolerance * scale
+
+            energies = np.insert(energies, left + 1, middles)
+            values = np.insert(values, left + 1, middle_values)
+            # the halves of the j-th refined interval start at left[j] + j and left[j] + j + 1
+            first = left + np.arange(len(left))
+            active = np.zeros(len(energies) - 1, dtype=bool)
+            active[first] = refine
+            active[first + 1] = refine
+        return {'energy': energies, 'spectra': values}
+
+    def create_time_resolved_spectra(self, int_n):
+        """ spectra of the light emitted within successive gates of the emission time
+
+        The time integral over a gate of width gate_ps (every gate_step_ps) takes the place of int_n; all
+        gates are normalized by the photons of the whole run, so that gates which tile the run add up to the
+        time-integrated spectrum. The kernel is linear in D, so one eigendecomposition of M (or one matrix
+        exponential per time step for the expm engine) serves all gates at once.
+        """
+        gate = self.gate / HBAR_EV_PS
+        gate_step = self.gate_step / HBAR_EV_PS
+        starts = np.arange(0, self.all_time[-1], gate_step)
+        gates = (self.all_time >= starts[:, None]) & (self.all_time < starts[:, None] + gate)
+        # the last time step closes the gates that reach it
+        gates[:, -1] |= self.all_time[-1] <= starts + gate
+        weights = self.quadrature_weights(len(self.dynamics_result))
+        gated = self.unpack_state(np.dot(gates * weights, self.dynamics_result)).reshape(len(starts), self.N, self.N)
+
+        D = np.zeros(shape=(len(starts), self.N, self.N), dtype=np.complex128)
+        D[:, :, 1:] = np.transpose(gated[:, 1:, :], (0, 2, 1)) / (np.pi * (np.trace(int_n) - int_n[0][0]))
+        M = self.create_spectral_matrix()
+        energies = self.create_energy_interval()
+
+        decomposition = self.diagonalize(M, D) if self.spectra_engine == 'eigen' else None
+        if decomposition is not None:
+            spectra = self.spectrum_from_eigenvalues(decomposition[0], decomposition[1].T, energies)
+        else:
+            int_emd = np.zeros(shape=(len(self.lag_time), len(starts)), dtype=np.complex128)
+            for i in range(len(self.lag_time)):
+                int_emd[i] = np.einsum('ab,jba->j', scl.expm(M * self.lag_time[i]), D)
+                self.report_progress(i / len(self.lag_time) * 100)
+            spectra = self.fourier_transform(int_emd, energies)
+
+        centres = (starts + gate / 2) * HBAR_EV_S
+        return {'time': centres, 'energy': energies, 'spectra': spectra.T}
+
+    def evaluate_spectra(self, kernel, energies):
+        if 'eigenvalues' in kernel:
+            return {'spectra': self.spectrum_from_eigenvalues(kernel['eigenvalues'], kernel['weights'], energies)}
+        return {'spectra': self.fourier_transform(kernel['int_emd'], energies)}
+
+    def quadrature_weights(self, count):
+        """ weights of the time integration rule over the first count points of all_time """
+        if self.quadrature == 'rectangle' or count < 2:
+            return np.full(count, self.time_step)
+
+        dt = self.all_time[1] - self.all_time[0]
+        weights = np.full(count, dt)
+        if self.quadrature == 'trapezoid' or count < 3:
+            weights[[0, -1]] = dt / 2
+        elif self.quadrature == 'simpson':
+            # composite Simpson over an even number of intervals, the trapezoid rule on a leftover last interval
+            odd = count if count % 2 else count - 1
+            weights[:odd] = dt / 3
+            weights[1:odd - 1:2] = 4 * dt / 3
+            weights[2:odd - 1:2] = 2 * dt / 3
+            if odd < count:
+                weights[odd - 1] += dt / 2
+                weights[-1] = dt / 2
+        else:
+            raise ValueError(f"Unknown quadrature rule: {self.quadrature}")
+        return weights
+
+    def fourier_transform(self, int_emd, energies):
+        """ sum over the time grid of int_emd * exp(1j * E * t) * time_step for every energy
+
+        Energies are processed in blocks of chunk_size, so memory stays at chunk_size * len(all_time) values.
+        """
+        spectra = np.zeros(shape=(len(energies),) + int_emd.shape[1:], dtype=np.complex128)
+        for start in range(0, len(energies), self.chunk_size):
+            stop = min(start + self.chunk_size, len(energies))
+            kernel = np.exp(1j * np.outer(energies[start:stop], self.lag_time))
+            spectra[start:stop] = np.dot(kernel, int_emd) * self.time_step
+
+            self.report_progress(stop / len(energies) * 100)
+        return spectra
+
+    def parameters(self):
+        """ the resolved parameters of the calculation (energies and rates per mode) and its config as YAML text """
+        return {'energies_ev': self.W, 'dampings_ev': self.gamma, 'pumpings_ev': self.P, 'strengths_ev': self.g,
+                'initial_counts': self.initial_count, 'interaction_ev': np.array(self.k),
+                'config': np.array(yaml.safe_dump(self.config_data, default_flow_style=False))}
+
+    def results(self):
+        """ arrays of the last calculation: time in s, populations, full correlations, energies and spectra,
+        and the parameters
+
+        The full correlations are a PackedTrajectory, unpacked row by row when they are read or saved.
+        """
+        results = {'time': self.time_for_graph, 'populations': self.populations}
+        if self.dynamics_result is not None:
+            results['dynamics'] = PackedTrajectory(self, self.dynamics_result)
+        if self.spectra is not None:
+            results['energy'] = self.energy_interval
+            results['spectra'] = self.spectra
+        if self.time_resolved_spectra is not None:
+            results['gate_time'] = self.gate_times
+            results['gate_energy'] = self.gate_energies
+            results['time_resolved_spectra'] = self.time_resolved_spectra
+        results.update(self.parameters())
+        return results
+
+
+class SimulationBatch(Simulation):
+    """ dynamics of several simulations that differ only in their initial counts and pumping, calculated together
+
+    The packed states of all members are stacked into one state, so the solver makes one call of the vectorized
+    right-hand side per step for the whole batch; with the propagator engine, every time step is a single
+    batched matrix product. The results are handed to the members, which then continue as usual (spectra).
+    """
+
+    def __init__(self, simulations):
+        super().__init__()
+        if len({simulation.compute_equations_key() for simulation in simulations}) > 1:
+            raise ValueError("Only simulations that differ in initial counts and pumping can be batched")
+        if simulations[0].dynamics_engine == 'star':
+            raise ValueError("The star engine cannot be batched")
+        self.members = simulations
+        self.config_data = simulations[0].config_data
+        self.setup_parameters()
+        self.cache = None
+        self.stack(simulations)
+
+    def stack(self, simulations):
+        """ make the initial counts and pumping of simulations the stacked parameters of the batch """
+        self.stacked = simulations
+        self.initial_count = np.array([simulation.initial_count for simulation in simulations])
+        self.P = np.array([simulation.P for simulation in simulations])
+        self.G = self.gamma - self.P
+
+    def create_linear_step(self, dt):
+        """ the step shared by all members when their pumping is the same, otherwise a stack of steps """
+        if np.all(self.P == self.P[0]):
+            return self.stacked[0].create_linear_step(dt)
+        steps = [simulation.create_linear_step(dt) for simulation in self.stacked]
+        return np.array([U for U, _ in steps]), np.array([Q for _, Q in steps])
+
+    def propagate_linear(self, n0, count, U, Q):
+        """ with a shared step, one matrix product per time step: row-major vec(U n U^H) = (U x conj(U)) vec(n) """
+        if U.ndim > 2:
+            return super().propagate_linear(n0, count, U, Q)
+        step = np.kron(U, U.conj()).T
+        q = Q.ravel()
+        result = np.zeros(shape=(count,) + n0.shape, dtype=np.complex128)
+        n = n0
+        for i in range(count):
+            n = np.dot(n, step) + q
+            result[i] = n
+        return result
+
+    def stationary_state(self):
+        steady_states = []
+        for simulation in self.stacked:
+            simulation.prepare_packing()
+            steady_states.append(simulation.stationary_state())
+        return np.array(steady_states)
+
+    def prepare_jacobian(self):
+        for simulation in self.stacked:
+            simulation.prepare_dynamics_kernel()
+            simulation.prepare_jacobian()
+
+    def dynamics_jacobian(self, x, t):
+        """ block diagonal Jacobian of the stacked states """
+        return sparse.block_diag([simulation.dynamics_jacobian(state, t) for simulation, state in zip(self.stacked, x)],
+                                 format='csr')
+
+    def calculate_dynamics(self, progress_callback=None):
+        """ integrate the members whose dynamics are not stored yet together, then calculate the dynamics of every
+        member from the stored results """
+        self.start_progress(progress_callback)
+        self.all_time = self.create_time_grid()
+        self.rhs_evaluations = 0
+        self.jacobian_evaluations = 0
+        self.uses_solver = False
+        self.prepare_packing()
+
+        keys = [simulation.compute_dynamics_key() for simulation in self.members]
+        pending = [i for i, simulation in enumerate(self.members) if not simulation.has_stage('dynamics', keys[i])]
+        if pending:
+            self.stack([self.members[i] for i in pending])
+            dynamics = self.integrate_dynamics()
+            for j, i in enumerate(pending):
+                # the batch axis follows the time axis, except for the time integral
+                arrays = {name: values if values.ndim == 0 else values[j] if name == 'int_n' else values[:, j]
+                          for name, values in dynamics.items()}
+                self.members[i].seed_stage('dynamics', keys[i], arrays)
+
+        for simulation in self.members:
+            simulation.calculate_dynamics()
+        self.report_progress(100)
+
+
+def run_simulation(config, progress_callback=None):
+    """ run dynamics and spectra for a config dict or a path to a YAML config file
+
+    progress_callback, if given, is called with the progress of the current stage in percent.
+    """
+    if isinstance(config, str):
+        config_manager = ConfigManager(config)
+        config_manager.load_config()
+        config = config_manager.config_data
+
+    simulation = Simulation()
+    simulation.set_config_data(config)
+    simulation.calculate_dynamics(progress_callback)
+    report = simulation.solver_report()
+    simulation.calculate_spectra(progress_callback)
+    results = simulation.results()
+    results['rhs_evaluations'] = report['rhs_evaluations']
+    results['jacobian_evaluations'] = report['jacobian_evaluations']
+    results['end_time_ps'] = report['end_time_ps']
+    if 'steady_state_ps' in report:
+        results['steady_state_ps'] = report['steady_state_ps']
+    return results
@@ -0,0 +1,167 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import copy
+import itertools
+import os
+import numpy as np
+import yaml
+from source.config_manager import ConfigManager
+from source.simulation import HBAR_EV_S, Simulation, SimulationBatch
+
+
+# parameters that define the time and energy grids must be the same for every point of a sweep
+GRID_PATHS = ['dynamic_configuration/time_step_ps', 'dynamic_configuration/time_end_ps',
+              'spectra_configuration/min_energy_ev', 'spectra_configuration/energy_step_ev',
+              'spectra_configuration/max_energy_ev']
+
+
+def run_batch(configs, store_populations):
+    """ run several points of a sweep in one task of a worker process
+
+    Cheap points then do not pay the process overhead one by one, and points that differ only in initial counts
+    and pumping are integrated together as a SimulationBatch.
+    """
+    simulations = []
+    groups = {}
+    for config_data in configs:
+        simulation = Simulation()
+        simulation.set_config_data(config_data)
+        simulations.append(simulation)
+        groups.setdefault(simulation.compute_equations_key(), []).append(simulation)
+
+    for group in groups.values():
+        if len(group) > 1 and group[0].dynamics_engine != 'star':
+            SimulationBatch(group).calculate_dynamics()
+        else:
+            for simulation in group:
+                simulation.calculate_dynamics()
+
+    results = []
+    for simulation in simulations:
+        simulation.calculate_spectra()
+        results.append((simulation.spectra, simulation.populations if store_populations else None))
+    return results
+
+
+def axis_values(axis):
+    """ values of a sweep axis given either as a list ('values') or as 'start', 'stop' and 'num' """
+    if 'values' in axis:
+        return [float(value) for value in axis['values']]
+    return [float(value) for value in np.linspace(axis['start'], axis['stop'], axis['num'])]
+
+
+class ParameterSweep:
+    """ runs the simulation over the grid spanned by the sweep axes on a process pool
+
+    Results are written as they arrive into .npy files in output_dir: spectra.npy has the shape
+    (*axis lengths, number of energies) and populations.npy (optional) the shape (*axis lengths, time, modes).
+    done.npy marks finished points, so an interrupted sweep resumes where it stopped.
+    Every task sent to a worker process runs batch_size points.
+    """
+
+    def __init__(self, base_config, axes, output_dir, workers=None, store_populations=False, batch_size=1):
+        self.base_config = base_config
+        self.axes = [{'path': axis['path'], 'values': axis_values(axis)} for axis in axes]
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count()
+        self.store_populations = store_populations
+        self.batch_size = batch_size
+
+        for axis in self.axes:
+            if axis['path'] in GRID_PATHS:
+                raise ValueError(f"The grid parameter {axis['path']} cannot be swept")
+        if base_config['spectra_configuration'].get('grid', 'uniform') != 'uniform':
+            raise ValueError("Sweeps store all spectra on one energy grid and need the uniform grid")
+
+    @classmethod
+    def from_file(cls, path):
+        """ sweep described by a YAML file with base_config, axes, output and optionally workers, store_populations
+        and batch_size """
+        with open(path, 'r') as file:
+            description = yaml.safe_load(file)
+        config_manager = ConfigManager(description['base_config'])
+        config_manager.load_config()
+        return cls(config_manager.config_data, description['axes'], description['output'],
+                   description.get('workers'), description.get('store_populations', False),
+                   description.get('batch_size', 1))
+
+    @property
+    def shape(self):
+        return tuple(len(axis['values']) for axis in self.axes)
+
+    def point_config(self, index):
+        config_manager = ConfigManager()
+        config_manager.config_data = copy.deepcopy(self.base_config)
+        for axis, i in zip(self.axes, index):
+            config_manager.set_value(axis['path'], axis['values'][i])
+        return config_manager.config_data
+
+    def open_outputs(self):
+        """ create the output arrays, or reopen them if the same sweep was already started """
+        description_path = os.path.join(self.output_dir, 'sweep.yaml')
+        description = {'base_config': self.base_config, 'axes': self.axes, 'store_populations': self.store_populations}
+        resume = os.path.exists(description_path)
+        if resume:
+            with open(description_path, 'r') as file:
+                if yaml.safe_load(file) != description:
+                    raise ValueError(f"{self.output_dir} contains results of a different sweep")
+        else:
+            os.makedirs(self.output_dir, exist_ok=True)
+
+        simulation = Simulation()
+        simulation.set_config_data(self.base_config)
+        energies = simulation.create_energy_interval()
+        time = simulation.population_time_grid()
+
+        def open_array(name, shape, dtype):
+            path = os.path.join(self.output_dir, name)
+            if resume:
+                return np.load(path, mmap_mode='r+')
+            return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+        self.done = open_array('done.npy', self.shape, bool)
+        self.spectra = open_array('spectra.npy', self.shape + (len(energies),), np.complex128)
+        self.populations = None
+        if self.store_populations:
+            self.populations = open_array('populations.npy', self.shape + (len(time), simulation.N), np.float64)
+
+        if not resume:
+            np.save(os.path.join(self.output_dir, 'energy.npy'), energies)
+            np.save(os.path.join(self.output_dir, 'time.npy'), time * HBAR_EV_S)
+            for i, axis in enumerate(self.axes):
+                np.save(os.path.join(self.output_dir, f'axis_{i}.npy'), axis['values'])
+            # written last: its presence marks a complete set of output files
+            with open(description_path, 'w') as file:
+                yaml.dump(description, file, default_flow_style=False)
+
+    def run(self, progress_callback=None):
+        """ run all points that are not done yet; progress_callback gets (finished points, total points) """
+        self.open_outputs()
+        pending = [index for index in itertools.product(*[range(length) for length in self.shape])
+                   if not self.done[index]]
+        total = self.done.size
+        finished = total - len(pending)
+
+        batches = [pending[start:start + self.batch_size] for start in range(0, len(pending), self.batch_size)]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(run_batch, [self.point_config(index) for index in batch],
+                                       self.store_populations): batch for batch in batches}
+            for future in as_completed(futures):
+                for index, (spectra, populations) in zip(futures[future], future.result()):
+                    self.spectra[index] = spectra
+                    if self.populations is not None:
+                        # populations of dynamics that stopped early end before the time grid, the rest stays zero
+                        self.populations[index][:len(populations)] = populations
+                    self.done[index] = True
+                self.flush()
+
+                finished += len(futures[future])
+                if progress_callback is not None:
+                    progress_callback(finished, total)
+
+        return self.spectra
+
+    def flush(self):
+        self.spectra.flush()
+        if self.populations is not None:
+            self.populations.flush()
+        self.done.flush()
@@ -0,0 +1,34 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+from source.simulation import CalculationCancelled
+
+
+class CalculationWorker(QObject):
+    """ runs calculation(progress_callback) on a background thread and reports back through signals
+
+    done is emitted with 'finished', 'cancelled' or 'failed' and an error message for the latter.
+    populations carries the populations that report_populations gets, e.g. from Simulation.populations_callback.
+    """
+
+    progress = pyqtSignal(int)
+    populations = pyqtSignal(object)
+    done = pyqtSignal(str, str)
+
+    def __init__(self, calculation):
+        super().__init__()
+        self.calculation = calculation
+
+    def run(self):
+        try:
+            self.calculation(self.report_progress)
+        except CalculationCancelled:
+            self.done.emit('cancelled', '')
+        except Exception as error:
+            self.done.emit('failed', str(error))
+        else:
+            self.done.emit('finished', '')
+
+    def report_progress(self, value):
+        self.progress.emit(int(value))
+
+    def report_populations(self, populations):
+        self.populations.emit(populations)
@@ -0,0 +1,50 @@
+""" Configs and states shared by the tests """
+import os
+import sys
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from source.simulation import Simulation  # noqa: E402
+
+MODES = os.path.join(ROOT, 'data', 'modes.csv')
+
+
+def create_config(engine, interaction_ev=0.0, pumping_ev=0.0):
+    """ exciton and the five modes of data/modes.csv between 3.4 and 3.6 eV """
+    return {
+        'photonic_modes': {'file_modes': MODES, 'energy_window_ev': [3.4, 3.6]},
+        'excitonic_mode': {'exciton_energy_ev': 3.5, 'damping_ev': 0.05, 'pumping_ev': pumping_ev,
+                           'initial_excitons': 1, 'interaction_ev': interaction_ev},
+        'dynamic_configuration': {'time_step_ps': 0.001, 'time_end_ps': 0.2, 'engine': engine,
+                                  'rtol': 1e-10, 'atol': 1e-12},
+        'spectra_configuration': {'min_energy_ev': 3.0, 'energy_step_ev': 0.001, 'max_energy_ev': 4.0},
+    }
+
+
+def create_simulation(config):
+    """ simulation of config with the equation of motion prepared """
+    simulation = Simulation()
+    simulation.set_config_data(config)
+    simulation.prepare_dynamics_kernel()
+    return simulation
+
+
+def run(config):
+    """ simulation of config after dynamics and spectra """
+    simulation = Simulation()
+    simulation.set_config_data(config)
+    simulation.calculate_dynamics()
+    simulation.calculate_spectra()
+    return simulation
+
+
+def random_state(N, seed=0):
+    """ random flattened Hermitian correlation matrix """
+    rng = np.random.default_rng(seed)
+    n = rng.normal(size=(N, N)) + 1j * rng.normal(size=(N, N))
+    return (n + n.conj().T).ravel()
+
+
+def relative_deviation(values, reference):
+    return np.abs(values - reference).max() / np.abs(reference).max()
@@ -0,0 +1,15 @@
+""" Checks of the vectorized equation of motion against the element-by-element reference
+
+Run from the repository root:
+
+    python -m pytest tests
+"""
+from common import create_config, create_simulation, random_state, relative_deviation
+
+
+def test_dynamics_matrix_matches_reference():
+    simulation = create_simulation(create_config('ode', interaction_ev=0.01, pumping_ev=0.002))
+    n = random_state(simulation.N)
+    packed = simulation.create_dynamics_matrix(simulation.pack_state(n), 0)
+    reference = simulation.create_dynamics_matrix_reference(n, 0)
+    assert relative_deviation(simulation.unpack_state(packed), reference) < 1e-13
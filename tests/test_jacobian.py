@@ -0,0 +1,18 @@
+""" Check of the analytic sparse Jacobian against finite differences """
+import numpy as np
+from common import create_config, create_simulation, random_state
+
+
+def test_jacobian_matches_finite_differences():
+    simulation = create_simulation(create_config('ode', interaction_ev=0.01))
+    simulation.prepare_jacobian()
+    x = simulation.pack_state(random_state(simulation.N, seed=1))
+    jacobian = simulation.dynamics_jacobian(x, 0).toarray()
+    step = 1e-6
+    # the imaginary parts of the diagonal are not state variables
+    for i in np.setdiff1d(np.arange(len(x)), 2 * simulation.packed_diagonal + 1):
+        shift = np.zeros(len(x))
+        shift[i] = step
+        difference = (simulation.create_dynamics_matrix(x + shift, 0)
+                      - simulation.create_dynamics_matrix(x - shift, 0)) / (2 * step)
+        assert np.abs(jacobian[:, i] - difference).max() < 1e-6
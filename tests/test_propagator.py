@@ -0,0 +1,10 @@
+""" Check of the exact linear propagator against the ode engine """
+from common import create_config, relative_deviation, run
+
+
+def test_propagator_matches_ode():
+    ode = run(create_config('ode', pumping_ev=0.002))
+    propagator = run(create_config('propagator', pumping_ev=0.002))
+    assert not propagator.uses_solver
+    assert relative_deviation(propagator.populations, ode.populations) < 1e-8
+    assert relative_deviation(propagator.spectra, ode.spectra) < 1e-8
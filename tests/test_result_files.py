@@ -0,0 +1,25 @@
+""" Round trip of the results of a run through save_results and load_results """
+import numpy as np
+from common import create_config, run
+from source.result_files import load_results, save_results
+
+
+def test_results_round_trip(tmp_path):
+    simulation = run(create_config('propagator', pumping_ev=0.002))
+    results = simulation.results()
+    path = str(tmp_path / 'results.npz')
+    save_results(path, results)
+    loaded = load_results(path)
+
+    assert set(loaded) == {name for name, value in results.items() if value is not None}
+    # large arrays are mapped from the file, found through the local headers of the zip entries
+    assert isinstance(loaded['dynamics'], np.memmap)
+    assert isinstance(loaded['populations'], np.memmap)
+    for name, value in results.items():
+        if value is not None:
+            value = np.asarray(value)
+            assert loaded[name].dtype == value.dtype and loaded[name].shape == value.shape, name
+            assert np.array_equal(np.asarray(loaded[name]), value), name
+    # the full (flattened) correlation matrices, unpacked from the stored upper triangles
+    n = np.asarray(loaded['dynamics'][-1]).reshape(simulation.N, simulation.N)
+    assert np.allclose(n.diagonal().real, simulation.populations[-1])
@@ -0,0 +1,23 @@
+""" Check of the many-mode star engine, including its backward pass, against the exact propagator """
+import numpy as np
+from common import MODES, create_config, relative_deviation, run
+from source.modes import load_mode_table
+
+
+def test_star_matches_propagator(tmp_path):
+    # a populated photon mode next to the exciton, so that two amplitude vectors are integrated
+    table = load_mode_table(MODES)
+    table['initial_photons'][len(table['initial_photons']) // 2] = 0.5
+    modes = tmp_path / 'modes.npz'
+    np.savez(modes, **table)
+
+    results = {}
+    for engine in ['propagator', 'star']:
+        config = create_config(engine)
+        config['photonic_modes']['file_modes'] = str(modes)
+        config['dynamic_configuration'].update(store_trajectory=False, population_stride=3)
+        results[engine] = run(config)
+    star, propagator = results['star'], results['propagator']
+    assert star.star_engine_active()
+    assert relative_deviation(star.populations, propagator.populations) < 1e-10
+    assert relative_deviation(star.spectra, propagator.spectra) < 1e-10
@@ -0,0 +1,33 @@
+""" Checks of the early termination of the dynamics against full runs """
+import numpy as np
+from common import create_config, relative_deviation, run
+
+
+def create_termination_config(store_trajectory, **termination):
+    config = create_config('propagator', pumping_ev=termination.pop('pumping_ev', 0.0))
+    config['dynamic_configuration'].update(time_end_ps=2.0, chunk_steps=50, store_trajectory=store_trajectory,
+                                           **termination)
+    config['spectra_configuration']['quadrature'] = 'simpson'
+    return config
+
+
+def test_decayed_run_matches_full_run():
+    full = run(create_termination_config(True))
+    stored = run(create_termination_config(True, stop_population=1e-6))
+    streamed = run(create_termination_config(False, stop_population=1e-6))
+    assert len(stored.all_time) < len(full.all_time)
+    assert len(streamed.all_time) == len(stored.all_time)
+    # the integral accumulated while streaming uses the rule of the shortened grid, like the stored trajectory
+    assert relative_deviation(streamed.stages['dynamics']['int_n'], stored.stages['int_n']['int_n']) < 1e-12
+    assert relative_deviation(streamed.spectra, full.spectra) < 1e-5
+
+
+def test_steady_run_matches_full_run():
+    full = run(create_termination_config(False, pumping_ev=0.002, population_stride=3))
+    steady = run(create_termination_config(False, pumping_ev=0.002, population_stride=3, stop_tolerance=1e-10))
+    assert 0 <= steady.steady_index < len(full.all_time) - 1
+    # the stationary tail fills the rest of the time grid on the population stride
+    assert steady.populations.shape == full.populations.shape
+    assert np.allclose(steady.time_for_graph, full.time_for_graph)
+    assert relative_deviation(steady.populations, full.populations) < 1e-8
+    assert relative_deviation(steady.spectra, full.spectra) < 1e-8